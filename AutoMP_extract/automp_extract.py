@@ -2,8 +2,65 @@ import sys
 
 from src.automp_extract import AutoMP_extract
 from src.log import Log
+from src.logindex import log_command
+from src.selection import SelectionOptions
+from src.tracing import Profiler, Trace
 from src.validator import Validator
 
+trace_path = Validator.pop_option(sys.argv, "--trace")
+if trace_path is not None:
+    Trace.enable(trace_path)
+profile_path = Validator.pop_option(sys.argv, "--profile")
+if profile_path is not None:
+    Profiler.enable(profile_path)
+
+jobs = Validator.pop_option(sys.argv, "--jobs") or "1"
+if not Validator.jobs(jobs):
+    sys.exit(1)
+
+options = SelectionOptions(
+    Validator.pop_option(sys.argv, "--select") or "score",
+    Validator.pop_option(sys.argv, "--flags-macro"),
+    Validator.pop_flag(sys.argv, "--reassemble"),
+)
+if not Validator.selection(options.strategy):
+    sys.exit(1)
+
+dedup_mode = Validator.pop_option(sys.argv, "--dedup")
+if dedup_mode is not None and not Validator.dedup(dedup_mode):
+    sys.exit(1)
+
+pack_out = Validator.pop_option(sys.argv, "--pack")
+if pack_out is not None and not Validator.pack_output(pack_out, dedup_mode):
+    sys.exit(1)
+
+precheck = Validator.pop_option(sys.argv, "--precheck")
+if precheck is not None and not Validator.precheck(precheck):
+    sys.exit(1)
+
+harness = Validator.pop_option(sys.argv, "--harness")
+if harness is not None and not Validator.harness(harness):
+    sys.exit(1)
+
+log_format = Validator.pop_option(sys.argv, "--log-format") or "text"
+log_fsync = Validator.pop_option(sys.argv, "--log-fsync") or "never"
+log_level = Validator.pop_option(sys.argv, "--log-level") or "info"
+log_max_bytes = Validator.pop_option(sys.argv, "--log-max-bytes")
+log_rotate = Validator.pop_option(sys.argv, "--log-rotate")
+log_compress = not Validator.pop_flag(sys.argv, "--log-no-compress")
+if not Validator.log_options(log_format, log_fsync, log_level):
+    sys.exit(1)
+if not Validator.log_rotation(log_max_bytes, log_rotate):
+    sys.exit(1)
+Log.configure_logfile(
+    log_format,
+    log_fsync,
+    int(log_max_bytes) if log_max_bytes is not None else None,
+    log_rotate,
+    log_compress,
+)
+Log.set_level(log_level)
+
 if len(sys.argv) < 2:
     Log.error("Usage: python automp_extract.py <command>")
     Log.info("To see all available commands, run:")
@@ -16,10 +73,29 @@ match sys.argv[1]:
         AutoMP_extract.list_commands()
     case "single":
         if Validator.single(sys.argv):
-            AutoMP_extract.single(sys.argv[2], sys.argv[3])
+            AutoMP_extract.single(sys.argv[2], sys.argv[3], options, harness)
     case "multiple":
         if Validator.multiple(sys.argv):
-            AutoMP_extract.multiple(sys.argv[2], sys.argv[3])
+            AutoMP_extract.multiple(
+                sys.argv[2],
+                sys.argv[3],
+                options,
+                int(jobs),
+                dedup_mode,
+                pack_out,
+                precheck,
+                harness,
+            )
+    case "watch":
+        if Validator.watch(sys.argv):
+            AutoMP_extract.watch(
+                sys.argv[2], sys.argv[3], options, dedup_mode, precheck, harness
+            )
+    case "pack":
+        if Validator.pack(sys.argv):
+            AutoMP_extract.pack(sys.argv[2], sys.argv[3])
+    case "log":
+        log_command(sys.argv[2:])
     case _:
         Log.error(f"Unknown command '{sys.argv[1]}'")
         AutoMP_extract.list_commands()
@@ -0,0 +1,60 @@
+from dataclasses import dataclass
+from typing import IO
+
+from .extract import CodeBlock, iter_code_blocks_from
+from .harness import apply_harness
+from .selection import SelectionOptions, extension, select_block
+
+
+@dataclass
+class Program:
+    name: str  # output file name, '<response name>.<extension>'
+    code: str
+    rationale: str
+    block: CodeBlock  # the chosen block, before the timing harness step
+    harness: str | None = None  # status of the timing harness step, if any
+
+
+def output_name(name: str, block: CodeBlock) -> str:
+    return f"{name}.{extension(block)}"
+
+
+def select_program(
+    code_blocks: list[CodeBlock],
+    name: str,
+    options: SelectionOptions | None = None,
+    harness: str | None = None,
+) -> Program:
+    """Chooses the program among the code blocks of the response 'name'"""
+    selection = select_block(code_blocks, options or SelectionOptions())
+    program = Program(
+        output_name(name, selection.block),
+        selection.block.code,
+        selection.rationale,
+        selection.block,
+    )
+    if harness is not None and extension(selection.block) == "c":
+        program.code, program.harness = apply_harness(program.code, harness)
+        program.rationale += f" (timing harness: {program.harness})"
+    return program
+
+
+def extract_program(
+    source: str | bytes | IO,
+    name: str,
+    options: SelectionOptions | None = None,
+    harness: str | None = None,
+) -> Program | None:
+    """
+    Extracts the program of a response in memory or in a stream, or returns
+    None if it has no code blocks. Uses the selection and naming of 'single',
+    'multiple' and 'watch', so that other tools can extract in-process:
+
+        program = extract_program(response, "2024-01-01__sum__model")
+        if program is not None:
+            print(program.name, program.rationale)
+    """
+    code_blocks = list(iter_code_blocks_from(source))
+    if len(code_blocks) == 0:
+        return None
+    return select_program(code_blocks, name, options, harness)
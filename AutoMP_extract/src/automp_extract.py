@@ -1,8 +1,25 @@
+import hashlib
 import os
+import signal
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from itertools import repeat
 
-from .extract import extract_code_blocks
+from .api import select_program
+from .dedup import DEDUP_FILENAME, DedupIndex, program_id
+from .extract import extract_code_blocks, iter_code_blocks_from
 from .log import Log
+from .manifest import MANIFEST_FILENAME, Manifest, hash_file
+from .pack import Pack, is_pack
+from .precheck import prechecked
+from .selection import SelectionOptions
+from .tracing import Trace
+from .watch import watch_files
+
+EXTRACT_CHUNKS_PER_JOB = 4
+MANIFEST_SAVE_INTERVAL_SECONDS = 5
 
 
 class AutoMP_extract:
@@ -14,10 +31,46 @@ class AutoMP_extract:
         Log.info("    commands")
         Log.info("    single <filepath_in> <filepath_out>")
         Log.info("    multiple <directory_in> <directory_out>")
+        Log.info("    watch <directory_in> <directory_out>")
+        Log.info("    pack <directory_in> <pack>")
+        Log.info(
+            "    log <directory> [--status S] [--task T] [--name N] [--since TS] [--until TS] [--tail N] [--count] [--reindex]"
+        )
+        Log.info("Options (all commands):")
+        Log.info("    --trace <path>      write a Chrome trace (JSON) of the run")
+        Log.info("    --profile <path>    write a per-function profile summary")
+        Log.info("    --jobs <n>          extract with n worker processes (multiple)")
+        Log.info("    --select <score|last|first>  how to choose among code blocks")
+        Log.info(
+            "    --flags-macro <name>  compiler flags macro that marks the program"
+        )
+        Log.info("    --reassemble        merge a program split across code blocks")
+        Log.info("    --pack <path>       write the programs into a pack (multiple)")
+        Log.info(
+            "    --precheck <compiler>  check the syntax of the programs (multiple, watch)"
+        )
+        Log.info(
+            "    --harness <check|wrap>  check the '[result, run_time]' output, wrap programs without it"
+        )
+        Log.info(
+            "    --dedup <copy|link|reference>  index duplicate programs (multiple, watch)"
+        )
+        Log.info("    --log-format <text|jsonl>")
+        Log.info("    --log-fsync <never|batch|always>")
+        Log.info("    --log-level <debug|info|error>")
+        Log.info("    --log-max-bytes <n>  rotate log.txt once it exceeds n bytes")
+        Log.info("    --log-rotate <hourly|daily|weekly>")
+        Log.info("    --log-no-compress   do not gzip rotated log files")
         sys.exit(0)
 
     @staticmethod
-    def single(filepath_in: str, filepath_out: str):
+    @Trace.traced("AutoMP_extract.single")
+    def single(
+        filepath_in: str,
+        filepath_out: str,
+        options: SelectionOptions,
+        harness: str | None = None,
+    ):
         log_dir = os.path.dirname(filepath_out)
         Log.logfile_write(log_dir, f"started single ({filepath_in} -> {filepath_out})")
 
@@ -28,84 +81,431 @@ class AutoMP_extract:
             Log.logfile_write_extraction(
                 log_dir, filepath_in, False, "no code blocks found"
             )
-        elif len(code_blocks) == 1:
-            Log.info("Found code block")
-            with open(filepath_out, "w") as f:
-                f.write(code_blocks[0].code)
-            Log.logfile_write_extraction(log_dir, filepath_in, True, "")
         else:
-            Log.info("Found multiple code blocks, chose the last")
-            with open(filepath_out, "w") as f:
-                f.write(code_blocks[-1].code)
-            Log.logfile_write_extraction(
-                log_dir, filepath_in, True, "found multiple code blocks, chose last"
+            program = select_program(
+                code_blocks, os.path.basename(filepath_in), options, harness
             )
+            Log.info(program.rationale[0].upper() + program.rationale[1:])
+            with open(filepath_out, "w") as f:
+                f.write(program.code)
+            Log.logfile_write_extraction(log_dir, filepath_in, True, program.rationale)
 
         Log.logfile_write(log_dir, "ended")
 
     @staticmethod
-    def multiple(directory_in: str, directory_out: str):
+    @Trace.traced("AutoMP_extract.multiple")
+    def multiple(
+        directory_in: str,
+        directory_out: str,
+        options: SelectionOptions,
+        jobs: int = 1,
+        dedup_mode: str | None = None,
+        pack_out: str | None = None,
+        precheck: str | None = None,
+        harness: str | None = None,
+    ):
+        """
+        directory_in may also be a pack; pack_out writes the programs into a
+        pack; precheck is the compiler for a syntax check of every program;
+        harness is the mode of the timing harness step
+        """
         Log.logfile_write(
             directory_out, f"started multiple ({directory_in} -> {directory_out})"
         )
-        for file in os.scandir(directory_in):
-            if not file.is_file():
-                continue
+        manifest = Manifest(
+            directory_out, _manifest_settings(options, precheck, harness)
+        )
+        input_pack = (
+            Pack(directory_in, read_only=True) if is_pack(directory_in) else None
+        )
+        output_pack = Pack(pack_out) if pack_out is not None else None
+        dedup = (
+            DedupIndex(directory_out, dedup_mode, output_pack) if dedup_mode else None
+        )
 
-            code_blocks = extract_code_blocks(file.path)
+        # (path, size, mtime_ns); files in a pack have the path '<pack>/<name>'
+        if input_pack is not None:
+            files = [
+                (os.path.join(input_pack.path, name), size, mtime_ns)
+                for name, size, mtime_ns in input_pack.entries()
+            ]
+        else:
+            files = [
+                (file.path, file.stat().st_size, file.stat().st_mtime_ns)
+                for file in os.scandir(directory_in)
+                if file.is_file()
+            ]
+        changed = [file[0] for file in files if not manifest.is_unchanged(*file)]
+        previous = [manifest.get(path) for path in changed]
+        if dedup is not None:
+            for path, entry in zip(changed, previous):
+                _release_output(dedup, path, entry, input_pack)
 
-            if len(code_blocks) == 0:
-                Log.error(f"No code blocks found in '{file.name}'")
-                Log.logfile_write_extraction(
-                    directory_out, file.name, False, "no code blocks found"
+        start = time.perf_counter()
+        if jobs > 1 and len(changed) > 1:
+            # chunks amortize the inter-process overhead of small files
+            chunksize = max(1, len(changed) // (jobs * EXTRACT_CHUNKS_PER_JOB))
+            with ProcessPoolExecutor(jobs) as executor:
+                extractions = executor.map(
+                    _extract_file,
+                    changed,
+                    repeat(directory_out),
+                    repeat(options),
+                    previous,
+                    repeat(input_pack),
+                    repeat(output_pack),
+                    repeat(harness),
+                    chunksize=chunksize,
                 )
-                continue
-
-            outpath = os.path.join(
+                if precheck is not None:
+                    extractions = prechecked(extractions, precheck)
+                total_bytes, skipped = AutoMP_extract.__log_extractions(
+                    directory_out,
+                    manifest,
+                    dedup,
+                    AutoMP_extract.__in_input_order(files, manifest, extractions),
+                )
+        else:
+            extractions = map(
+                _extract_file,
+                changed,
+                repeat(directory_out),
+                repeat(options),
+                previous,
+                repeat(input_pack),
+                repeat(output_pack),
+                repeat(harness),
+            )
+            if precheck is not None:
+                extractions = prechecked(extractions, precheck)
+            total_bytes, skipped = AutoMP_extract.__log_extractions(
                 directory_out,
-                f"{file.name}.{code_blocks[0].language if code_blocks[0].language != '' else 'c'}",
+                manifest,
+                dedup,
+                AutoMP_extract.__in_input_order(files, manifest, extractions),
             )
+        manifest.save()
+        if dedup is not None:
+            dedup.save()
+        if output_pack is not None:
+            # AutoMP_test with an input-pack finds the pre-check results and
+            # the dedup index here
+            for filename in [MANIFEST_FILENAME] + ([DEDUP_FILENAME] if dedup else []):
+                with open(os.path.join(directory_out, filename), "rb") as f:
+                    output_pack.write(filename, f.read())
+        for pack in (input_pack, output_pack):
+            if pack is not None:
+                pack.close()
+        seconds = time.perf_counter() - start
 
-            if len(code_blocks) == 1:
-                if os.path.exists(outpath):
-                    Log.error(
-                        f"One code block found, but the output file '{outpath}' already exists"
+        if skipped:
+            Log.info(f"Skipped {skipped} unchanged file{'s' if skipped > 1 else ''}")
+        processed = len(files) - skipped
+        if processed:
+            Log.info(
+                f"Processed {processed} files ({round(total_bytes / 1e6, 2)} MB) in {round(seconds, 2)}s: "
+                f"{round(processed / seconds, 1)} files/s, {round(total_bytes / 1e6 / seconds, 2)} MB/s"
+            )
+        Log.logfile_write(directory_out, "ended")
+
+    @staticmethod
+    def watch(
+        directory_in: str,
+        directory_out: str,
+        options: SelectionOptions,
+        dedup_mode: str | None = None,
+        precheck: str | None = None,
+        harness: str | None = None,
+    ):
+        signal.signal(signal.SIGTERM, AutoMP_extract.__shutdown)
+        Log.info(f"Watching '{directory_in}' for new responses")
+        Log.logfile_write(
+            directory_out, f"started watch ({directory_in} -> {directory_out})"
+        )
+        manifest = Manifest(
+            directory_out, _manifest_settings(options, precheck, harness)
+        )
+        dedup = DedupIndex(directory_out, dedup_mode) if dedup_mode else None
+        saved = time.monotonic()
+        try:
+            for path in watch_files(directory_in):
+                try:
+                    stat = os.stat(path)
+                    if manifest.is_unchanged(path, stat.st_size, stat.st_mtime_ns):
+                        extraction = _skipped_extraction(path, manifest.get(path))
+                    else:
+                        if dedup is not None:
+                            _release_output(dedup, path, manifest.get(path))
+                        extraction = _extract_file(
+                            path,
+                            directory_out,
+                            options,
+                            manifest.get(path),
+                            harness=harness,
+                        )
+                        if precheck is not None:
+                            extraction = next(prechecked([extraction], precheck))
+                    AutoMP_extract.__log_extractions(
+                        directory_out, manifest, dedup, [extraction]
                     )
+                except Exception as error:
+                    # e.g. the file was removed or is unreadable; it is not
+                    # recorded in the manifest, so its next event retries it
+                    filename = os.path.basename(path)
+                    Log.error(f"{filename}: extraction failed ({error})")
                     Log.logfile_write_extraction(
-                        directory_out,
-                        file.name,
-                        False,
-                        f"output file '{outpath}' already exists",
+                        directory_out, filename, False, f"extraction failed: {error}"
                     )
-                    continue
-                Log.info(f"Found code block in '{file.name}'")
-                with open(outpath, "w") as f:
-                    f.write(code_blocks[0].code)
-                Log.logfile_write_extraction(directory_out, file.name, True, "")
+                if time.monotonic() - saved >= MANIFEST_SAVE_INTERVAL_SECONDS:
+                    manifest.save()
+                    if dedup is not None:
+                        dedup.save()
+                    saved = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            manifest.save()
+            if dedup is not None:
+                dedup.save()
+            Log.logfile_write(directory_out, "ended")
+
+    @staticmethod
+    def pack(directory_in: str, pack_path: str):
+        start = time.perf_counter()
+        pack = Pack(pack_path)
+        count = pack.add_directory(directory_in)
+        pack.close()
+        Log.success(
+            f"Packed {count} files from '{directory_in}' into '{pack_path}' in {round(time.perf_counter() - start, 2)}s"
+        )
+
+    @staticmethod
+    def __in_input_order(files, manifest: Manifest, extractions):
+        """Merges the extractions of changed files with the unchanged files"""
+        extractions = iter(extractions)
+        for path, size, mtime_ns in files:
+            if manifest.is_unchanged(path, size, mtime_ns):
+                yield _skipped_extraction(path, manifest.get(path))
             else:
-                if os.path.exists(outpath):
-                    Log.error(
-                        f"Multiple code blocks found, but the output file '{outpath}' already exists"
-                    )
-                    Log.logfile_write_extraction(
-                        directory_out,
-                        file.name,
-                        False,
-                        f"output file '{outpath}' already exists",
-                    )
-                    continue
-                Log.info(f"Found multiple code blocks in '{file.name}', chose the last")
-                with open(outpath, "w") as f:
-                    f.write(code_blocks[-1].code)
-                Log.logfile_write_extraction(
-                    directory_out,
-                    file.name,
-                    True,
-                    "found multiple code blocks, chose last",
-                )
+                yield next(extractions)
 
-        Log.logfile_write(directory_out, "ended")
+    @staticmethod
+    def __log_extractions(
+        directory_out: str,
+        manifest: Manifest,
+        dedup: DedupIndex | None,
+        extractions,
+    ) -> tuple[int, int]:
+        """
+        Logs the extractions in input order, records them in the manifest (and
+        the dedup index) and returns the bytes read and the number of skipped
+        files
+        """
+        total_bytes = 0
+        skipped = 0
+        for extraction in extractions:
+            if extraction.skipped:
+                skipped += 1
+                Log.logfile_write_skipped(
+                    directory_out, extraction.filename, extraction.message
+                )
+                manifest.update(extraction.filepath, extraction.entry)
+                continue
+            total_bytes += extraction.entry["size"]
+            if dedup is not None and extraction.success:
+                canonical = dedup.add(
+                    extraction.entry["output"], extraction.entry["program"]
+                )
+                if canonical is not None:
+                    extraction.message += f" (duplicate of {canonical})"
+                    extraction.entry["message"] = extraction.message
+            if extraction.success:
+                Log.info(extraction.console)
+            else:
+                Log.error(extraction.console)
+            Log.logfile_write_extraction(
+                directory_out,
+                extraction.filename,
+                extraction.success,
+                extraction.message,
+            )
+            manifest.update(extraction.filepath, extraction.entry)
+        return total_bytes, skipped
 
     @staticmethod
     def __shutdown(signum, frame):
         sys.exit(0)
+
+
+@dataclass
+class Extraction:
+    filepath: str
+    filename: str
+    success: bool
+    message: str
+    console: str
+    entry: dict  # manifest entry of the input
+    skipped: bool = False
+    code: str | None = None  # extracted program, for the syntax pre-check
+
+
+def _manifest_settings(
+    options: SelectionOptions, precheck: str | None, harness: str | None
+) -> dict:
+    settings = asdict(options)
+    if precheck is not None:
+        settings["precheck"] = precheck
+    if harness is not None:
+        settings["harness"] = harness
+    return settings
+
+
+def _skipped_extraction(filepath: str, entry: dict) -> Extraction:
+    status = "SUCCESS" if entry["success"] else "FAILURE"
+    return Extraction(
+        filepath,
+        os.path.basename(filepath),
+        entry["success"],
+        f"unchanged since the last run ({status})",
+        "",
+        entry,
+        skipped=True,
+    )
+
+
+def _extract_file(
+    filepath: str,
+    directory_out: str,
+    options: SelectionOptions,
+    previous: dict | None = None,
+    input_pack: Pack | None = None,
+    output_pack: Pack | None = None,
+    harness: str | None = None,
+) -> Extraction:
+    """
+    Extracts one response of 'multiple'; runs in worker processes with --jobs.
+    previous is the input's manifest entry from an earlier run, if any. With
+    packs, the response is read from input_pack and the program written to
+    output_pack instead of the file system. harness is the mode of the timing
+    harness step, if any.
+    """
+    filename = os.path.basename(filepath)
+    if input_pack is not None:
+        content = input_pack.read(filename)
+        size, mtime_ns = len(content), input_pack.mtime_ns(filename)
+        content_hash = hashlib.sha256(content).hexdigest()
+    else:
+        stat = os.stat(filepath)
+        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        content_hash = hash_file(filepath)
+    entry = {
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "hash": content_hash,
+        "success": False,
+        "message": "",
+        "output": None,
+    }
+
+    if previous is not None:
+        if previous["hash"] == entry["hash"]:
+            # only touched, the result of the last run still holds
+            entry.update(
+                success=previous["success"],
+                message=previous["message"],
+                output=previous["output"],
+            )
+            return _skipped_extraction(filepath, entry)
+        if previous["output"] is not None:
+            # the input changed, so its old output is replaced
+            _remove_output(previous["output"], output_pack)
+
+    def result(success: bool, message: str, console: str, output: str = None):
+        entry.update(
+            success=success,
+            message=message,
+            output=os.path.abspath(output) if output is not None else None,
+            program=program_id(program.code) if success else None,
+        )
+        return Extraction(
+            filepath,
+            filename,
+            success,
+            message,
+            console,
+            entry,
+            code=program.code if success else None,
+        )
+
+    if input_pack is not None:
+        code_blocks = list(iter_code_blocks_from(content))
+    else:
+        code_blocks = extract_code_blocks(filepath)
+
+    if len(code_blocks) == 0:
+        return result(
+            False, "no code blocks found", f"No code blocks found in '{filename}'"
+        )
+
+    program = select_program(code_blocks, filename, options, harness)
+    if program.harness is not None:
+        entry["harness"] = program.harness
+    rationale = program.rationale
+    outname = program.name
+    if output_pack is not None:
+        outpath = os.path.join(output_pack.path, outname)
+        exists = output_pack.exists(outname)
+    else:
+        outpath = os.path.join(directory_out, outname)
+        exists = os.path.exists(outpath)
+
+    if exists:
+        return result(
+            False,
+            f"output file '{outpath}' already exists",
+            f"{'One code block' if len(code_blocks) == 1 else 'Multiple code blocks'} found, "
+            f"but the output file '{outpath}' already exists",
+        )
+
+    if output_pack is not None:
+        output_pack.write(outname, program.code.encode())
+    else:
+        with open(outpath, "w") as f:
+            f.write(program.code)
+    if len(code_blocks) == 1:
+        return result(True, rationale, f"Found code block in '{filename}'", outpath)
+    return result(
+        True,
+        rationale,
+        f"Found multiple code blocks in '{filename}': {rationale}",
+        outpath,
+    )
+
+
+def _release_output(
+    dedup: DedupIndex,
+    filepath: str,
+    previous: dict | None,
+    input_pack: Pack | None = None,
+):
+    """
+    Releases the output of an earlier run from the dedup index before it is
+    replaced, unless the input was only touched and its output is kept
+    """
+    if previous is None or previous["output"] is None:
+        return
+    if input_pack is not None:
+        content_hash = hashlib.sha256(
+            input_pack.read(os.path.basename(filepath))
+        ).hexdigest()
+    else:
+        content_hash = hash_file(filepath)
+    if content_hash != previous["hash"]:
+        dedup.release(previous["output"])
+
+
+def _remove_output(path: str, output_pack: Pack | None):
+    if output_pack is not None and os.path.dirname(path) == output_pack.path:
+        output_pack.remove(os.path.basename(path))
+    elif os.path.exists(path):
+        os.remove(path)
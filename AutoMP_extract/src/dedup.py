@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+
+from .pack import Pack
+
+DEDUP_FILENAME = "dedup.json"
+DEDUP_MODES = ["copy", "link", "reference"]
+
+# string and character literals, comments, whitespace, words, any other character
+C_TOKEN = re.compile(
+    r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|//[^\n]*|/\*.*?(?:\*/|\Z)|\s+|\w+|.',
+    re.DOTALL,
+)
+OPERATOR_CHARACTERS = "+-*/%&|^<>=!.:"
+
+
+def normalize_c(code: str) -> str:
+    """
+    Removes comments and whitespace from C code, except for a single space
+    between two words or two operators and anything inside string and
+    character literals
+    """
+    tokens = []
+    separated = False
+    for match in C_TOKEN.finditer(code):
+        token = match.group()
+        if token[0].isspace() or token.startswith(("//", "/*")):
+            separated = True
+            continue
+        if separated and tokens and _would_merge(tokens[-1][-1], token[0]):
+            tokens.append(" ")
+        tokens.append(token)
+        separated = False
+    return "".join(tokens)
+
+
+def _would_merge(left: str, right: str) -> bool:
+    # 'unsigned long' or 'a - -b' change their meaning without the space
+    return (_is_word(left) and _is_word(right)) or (
+        left in OPERATOR_CHARACTERS and right in OPERATOR_CHARACTERS
+    )
+
+
+def _is_word(character: str) -> bool:
+    return character.isalnum() or character == "_"
+
+
+def program_id(code: str) -> str:
+    """Identifies a program independent of its comments and formatting"""
+    return hashlib.sha256(normalize_c(code).encode()).hexdigest()[:16]
+
+
+class DedupIndex:
+    """
+    DedupIndex maps every extracted output file to the ID of its normalized
+    program, and every program ID to its canonical output file, the first one
+    extracted with it. It is stored as 'dedup.json' in the output directory.
+
+    Modes for duplicates: 'copy' keeps them as they are, 'link' replaces them
+    with hard links to the canonical file and 'reference' removes them, so
+    that they only exist in the index. With a pack, the output files are in
+    the pack instead of the output directory ('copy' only).
+    """
+
+    def __init__(self, directory_out: str, mode: str, pack: Pack | None = None):
+        self._directory = directory_out
+        self._mode = mode
+        self._pack = pack
+        self._path = os.path.join(directory_out, DEDUP_FILENAME)
+        self._programs: dict[str, str] = {}
+        self._files: dict[str, str] = {}
+        if os.path.exists(self._path):
+            with open(self._path, "r") as file:
+                data = json.load(file)
+            self._programs = data["programs"]
+            self._files = data["files"]
+
+    def add(self, output_path: str, program: str) -> str | None:
+        """
+        Records the output file and, if it duplicates an earlier program,
+        applies the mode and returns the canonical file
+        """
+        filename = os.path.basename(output_path)
+        self._files[filename] = program
+        canonical = self._programs.get(program)
+        if canonical is None or (
+            canonical != filename and not self.__exists(canonical)
+        ):
+            self._programs[program] = filename
+            return None
+        if canonical == filename:
+            return None
+
+        if self._mode == "link":
+            os.remove(output_path)
+            os.link(os.path.join(self._directory, canonical), output_path)
+        elif self._mode == "reference":
+            os.remove(output_path)
+        return canonical
+
+    def __exists(self, filename: str) -> bool:
+        if self._pack is not None:
+            return self._pack.exists(filename)
+        return os.path.exists(os.path.join(self._directory, filename))
+
+    def release(self, output_path: str):
+        """
+        Forgets an output file before it is replaced or removed. If it is the
+        canonical file of its program, the next duplicate becomes canonical;
+        in 'reference' mode, the duplicate is restored from it first.
+        """
+        filename = os.path.basename(output_path)
+        program = self._files.pop(filename, None)
+        if program is None or self._programs.get(program) != filename:
+            return
+        duplicate = next(
+            (name for name, other in self._files.items() if other == program), None
+        )
+        if duplicate is None:
+            del self._programs[program]
+            return
+        if self._mode == "reference":
+            shutil.copy2(output_path, os.path.join(self._directory, duplicate))
+        self._programs[program] = duplicate
+
+    def save(self):
+        with open(f"{self._path}.tmp", "w") as file:
+            json.dump({"programs": self._programs, "files": self._files}, file)
+        os.replace(f"{self._path}.tmp", self._path)
@@ -1,5 +1,15 @@
-from dataclasses import dataclass
+import io
 import re
+from dataclasses import dataclass
+from typing import IO, Iterable, Iterator
+
+from .tracing import Trace
+
+# up to three spaces of indentation, then at least three backticks or tildes
+OPENING_FENCE = re.compile(r"^( {0,3})(`{3,}|~{3,})(.*)$")
+CLOSING_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})[ \t]*$")
+# an opening fence after text on the same line, e.g. 'Here: ```c'
+INLINE_OPENING_FENCE = re.compile(r"```(\w*)[ \t]*$")
 
 
 @dataclass
@@ -7,17 +17,99 @@ class CodeBlock:
     language: str
     code: str
     length: int
+    terminated: bool = True
 
 
-def extract_code_blocks(filepath) -> list[CodeBlock]:
-    code_blocks = []
-    with open(filepath, "r", encoding="utf-8") as f:
-        content = f.read()
+def iter_code_blocks(lines: Iterable[str | bytes]) -> Iterator[CodeBlock]:
+    """
+    Yields the fenced code blocks of a Markdown document in a single pass over
+    its lines, so only the current block is held in memory. Accepts any
+    iterable of lines, e.g. a file object, or iter(mmap.readline, b"").
+
+    Fences are ``` or ~~~ (three or more, indented by at most three spaces,
+    trailing whitespace allowed); a block is only closed by a fence of the same
+    character that is at least as long as the opening one, so shorter fences
+    inside it are part of the code. A block that is still open at the end is
+    yielded with terminated=False. Like the former regex scan, a ``` at the
+    end of a line of text also opens a block:
+
+    >>> [b.code for b in iter_code_blocks(["Here: ```c", "int x;", "```"])]
+    ['int x;']
+    """
+    fence = None  # (character, length, indentation) of the open block
+    language = ""
+    code = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.rstrip("\r\n")
+
+        # cheap check before the regular expressions: fences start with ` or ~
+        candidate = line[:4].lstrip(" ")[:1] in ("`", "~")
 
-    pattern = r"```(\w*)\n(.*?)\n```"
-    matches = re.findall(pattern, content, re.DOTALL)
+        if fence is None:
+            if not candidate:
+                match = INLINE_OPENING_FENCE.search(line)
+                # an even number of ``` on the line is inline code (```x```)
+                if match is not None and line.count("```") % 2 == 1:
+                    fence = ("`", 3, 0)
+                    language = match.group(1)
+                    code = []
+                continue
+            match = OPENING_FENCE.match(line)
+            if match is None:
+                continue
+            indentation, marker, info = match.groups()
+            if marker[0] == "`" and "`" in info:
+                # inline code such as ```x```, not a fence
+                continue
+            fence = (marker[0], len(marker), len(indentation))
+            language = info.split()[0] if info.strip() else ""
+            code = []
+            continue
+
+        match = CLOSING_FENCE.match(line) if candidate else None
+        if (
+            match is not None
+            and match.group(1)[0] == fence[0]
+            and len(match.group(1)) >= fence[1]
+        ):
+            yield _code_block(language, code)
+            fence = None
+            continue
+
+        if fence[2] == 0 or not line.startswith(" "):
+            code.append(line)
+        else:
+            # content lines lose up to as much indentation as the opening fence had
+            stripped = len(line) - len(line.lstrip(" "))
+            code.append(line[min(stripped, fence[2]) :])
+
+    if fence is not None:
+        yield _code_block(language, code, terminated=False)
+
+
+def _code_block(language: str, lines: list[str], terminated: bool = True):
+    code = "\n".join(lines)
+    return CodeBlock(language, code, len(code), terminated)
+
+
+@Trace.traced("extract_code_blocks")
+def extract_code_blocks(filepath) -> list[CodeBlock]:
+    with open(filepath, "r", encoding="utf-8", newline="") as f:
+        return list(iter_code_blocks(f))
 
-    for language, code in matches:
-        code_blocks.append(CodeBlock(language, code, len(code)))
 
-    return code_blocks
+def iter_code_blocks_from(source: str | bytes | IO) -> Iterator[CodeBlock]:
+    """
+    Yields the code blocks of a response in memory (str or UTF-8 bytes) or of
+    any text or binary stream, without a round trip through the file system.
+    Lines of a str or bytes end like in extract_code_blocks: at \\n, \\r\\n or
+    \\r. A stream is split into lines as it was opened, so a binary stream or
+    a text stream opened with newline="\\n" does not end lines at a lone \\r.
+    """
+    if isinstance(source, bytes):
+        source = source.decode("utf-8", errors="replace")
+    if isinstance(source, str):
+        source = io.StringIO(source, newline="")
+    return iter_code_blocks(source)
@@ -0,0 +1,102 @@
+import re
+
+HARNESS_MODES = ["check", "wrap"]
+
+# a printf of the '[result, run_time]' line that AutoMP_test expects
+PROTOCOL_PATTERN = re.compile(
+    r'printf\s*\(\s*(?:stdout\s*,\s*)?"\s*\\?\[\s*%[-+ #0-9.]*[hlLqjzt]*[a-zA-Z]\s*,\s*%[-+ #0-9.]*[hlLqjzt]*[a-zA-Z]\s*\]'
+)
+MAIN_DEFINITION = re.compile(r"\b(int|void)\s+main\s*\(([^)]*)\)\s*\{")
+# 'int argc, char **argv' or 'int argc, char *argv[]' (names and const vary)
+ARGC_ARGV_PARAMETERS = re.compile(
+    r"\s*int\s+\w+\s*,\s*(?:const\s+)?char\s*"
+    r"(?:\*\s*(?:const\s*)?\*\s*\w+|\*\s*(?:const\s*)?\w+\s*\[\s*\])\s*"
+)
+WRAPPED_MAIN = "automp_main"
+
+# atexit also reports programs that end with exit() instead of returning;
+# clock_gettime instead of omp_get_wtime, so that it links without -fopenmp
+HARNESS = """
+/* AutoMP timing harness */
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+/* strict ISO C modes hide clock_gettime: C11 has timespec_get, C99 only clock */
+static double automp_now(void) {{
+#if defined(CLOCK_MONOTONIC)
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+#elif defined(TIME_UTC)
+    struct timespec ts;
+    timespec_get(&ts, TIME_UTC);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+#else
+    return (double)clock() / CLOCKS_PER_SEC;
+#endif
+}}
+
+static double automp_start;
+
+static void automp_report(void) {{
+    fflush(stdout);
+    printf("\\n[null, %.9f]\\n", automp_now() - automp_start);
+}}
+
+int main(int argc, char **argv) {{
+    automp_start = automp_now();
+    atexit(automp_report);
+    {call}
+}}
+"""
+
+
+def follows_protocol(code: str) -> bool:
+    """Whether the program prints a '[result, run_time]' line"""
+    return PROTOCOL_PATTERN.search(code) is not None
+
+
+def wrap(code: str) -> str | None:
+    """
+    Renames the main function of the program and adds a main function that
+    times it with a monotonic clock and prints '[null, run_time]', or returns None
+    if there is no main function to wrap: only 'main()', 'main(void)' and
+    'main(argc, argv)' can be called with the arguments of the new one
+    """
+    match = MAIN_DEFINITION.search(code)
+    if match is None:
+        return None
+    returns, parameters = match.groups()
+    if parameters.strip() in ("", "void"):
+        arguments = ""
+    elif ARGC_ARGV_PARAMETERS.fullmatch(parameters):
+        arguments = "argc, argv"
+    else:
+        return None
+    if returns == "void":
+        call = f"{WRAPPED_MAIN}({arguments});\n    return 0;"
+    else:
+        call = f"return {WRAPPED_MAIN}({arguments});"
+    renamed = (
+        code[: match.start()]
+        + f"{returns} {WRAPPED_MAIN}({parameters}) {{"
+        + code[match.end() :]
+    )
+    return renamed.rstrip("\n") + "\n" + HARNESS.format(call=call)
+
+
+def apply_harness(code: str, mode: str) -> tuple[str, str]:
+    """
+    Checks the program against the output protocol and, in mode 'wrap',
+    wraps the programs that do not follow it. Returns the program and its
+    status: 'ok', 'missing' (check), 'wrapped' or 'unwrappable' (wrap).
+    """
+    if follows_protocol(code):
+        return code, "ok"
+    if mode == "check":
+        return code, "missing"
+    wrapped = wrap(code)
+    if wrapped is None:
+        return code, "unwrappable"
+    return wrapped, "wrapped"
@@ -0,0 +1,308 @@
+import argparse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+
+LOG_FILENAME = "log.txt"
+INDEX_SUFFIX = ".idx"
+ROTATED_SUFFIX = r"\.\d{14}(-\d+)?(\.gz)?"
+# fields of a status record after timestamp and status, in text format
+RECORD_FIELDS = ["file"]
+
+
+def _task_from_name(name: str | None) -> str | None:
+    if name is None:
+        return None
+    parts = os.path.basename(name).split("__")
+    return parts[1] if len(parts) == 3 else None
+
+
+def _rotation_order(filename: str) -> tuple[str, int]:
+    # 'log.txt.<timestamp>[-<n>][.gz]', rotated in order of timestamp and n
+    rotation = filename.split(".")[2]
+    timestamp, _, n = rotation.partition("-")
+    return timestamp, int(n or 0)
+
+
+class LogIndex:
+    """
+    LogIndex is a sidecar SQLite index ('log.txt.idx') over the records of a
+    log file and its rotated files. Every record is stored with the file it
+    is in, its byte offset and length, its timestamp, status, task and model
+    (or file name), so that records can be filtered without reading the logs.
+    """
+
+    def __init__(self, log_path: str):
+        self._directory = os.path.dirname(log_path)
+        self._filename = os.path.basename(log_path)
+        self._connection = sqlite3.connect(
+            log_path + INDEX_SUFFIX, check_same_thread=False
+        )
+        # the index can always be rebuilt from the logs, so it is not synced
+        self._connection.executescript(
+            """
+            PRAGMA synchronous = OFF;
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS records (
+                file TEXT, offset INTEGER, length INTEGER, timestamp TEXT,
+                status TEXT, task TEXT, name TEXT
+            );
+            CREATE INDEX IF NOT EXISTS records_timestamp ON records (timestamp);
+            CREATE INDEX IF NOT EXISTS records_status ON records (status);
+            CREATE INDEX IF NOT EXISTS records_task ON records (task);
+            CREATE INDEX IF NOT EXISTS records_name ON records (name);
+            """
+        )
+        self._pending = []
+
+    def add(self, offset: int, length: int, fields: dict, filename: str = None):
+        name = fields.get("model", fields.get("file"))
+        self._pending.append(
+            (
+                filename or self._filename,
+                offset,
+                length,
+                fields.get("timestamp"),
+                fields.get("status"),
+                fields.get("task") or _task_from_name(name),
+                name,
+            )
+        )
+
+    def commit(self):
+        if self._pending:
+            self._connection.executemany(
+                "INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending
+            )
+            self._pending = []
+        self._connection.commit()
+
+    def rename(self, old_filename: str, new_filename: str):
+        self.commit()
+        self._connection.execute(
+            "UPDATE records SET file = ? WHERE file = ?", (new_filename, old_filename)
+        )
+        self._connection.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def query(
+        self,
+        status: str | None = None,
+        task: str | None = None,
+        name: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+        tail: int | None = None,
+    ) -> list[tuple[str, int, int]]:
+        """Returns (file, offset, length) of the matching records in log order"""
+        where, parameters = self.__where(status, task, name, since, until)
+        if tail is None:
+            return self._connection.execute(
+                f"SELECT file, offset, length FROM records{where} ORDER BY rowid",
+                parameters,
+            ).fetchall()
+        rows = self._connection.execute(
+            f"SELECT file, offset, length FROM records{where} ORDER BY rowid DESC LIMIT ?",
+            parameters + [tail],
+        ).fetchall()
+        return rows[::-1]
+
+    def count(self, status=None, task=None, name=None, since=None, until=None) -> int:
+        where, parameters = self.__where(status, task, name, since, until)
+        return self._connection.execute(
+            f"SELECT COUNT(*) FROM records{where}", parameters
+        ).fetchone()[0]
+
+    def read(self, rows: list[tuple[str, int, int]]):
+        """Yields the records of the given rows, opening every file once"""
+        current_name, current_file = None, None
+        for filename, offset, length in rows:
+            if filename != current_name:
+                if current_file is not None:
+                    current_file.close()
+                path = os.path.join(self._directory, filename)
+                current_file = (
+                    gzip.open(path, "rb")
+                    if filename.endswith(".gz")
+                    else open(path, "rb")
+                )
+                current_name = filename
+            current_file.seek(offset)
+            yield current_file.read(length).decode(errors="replace").rstrip("\n")
+        if current_file is not None:
+            current_file.close()
+
+    def rebuild(self):
+        """Indexes all existing log files from scratch"""
+        self._connection.execute("DELETE FROM records")
+        for filename in self.__log_filenames():
+            path = os.path.join(self._directory, filename)
+            if not os.path.exists(path):
+                continue
+            opener = gzip.open if filename.endswith(".gz") else open
+            with opener(path, "rb") as file:
+                self.__index_file(file, filename)
+        self.commit()
+
+    def lacks_records(self) -> bool:
+        """
+        Whether the log files hold records from before the index existed: a
+        file without indexed records, or one whose first indexed record is
+        not at its start
+        """
+        first_offsets = dict(
+            self._connection.execute(
+                "SELECT file, MIN(offset) FROM records GROUP BY file"
+            ).fetchall()
+        )
+        for filename in self.__log_filenames():
+            path = os.path.join(self._directory, filename)
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                continue
+            if first_offsets.get(filename, 1) > 0:
+                return True
+        return False
+
+    def catch_up(self):
+        """
+        Indexes the records that the index lacks: all of them (rebuild) if it
+        was created next to existing logs, otherwise the ones at the end of
+        the log file that were written but not committed to the index
+        """
+        if self.lacks_records():
+            self.rebuild()
+            return
+        end = self._connection.execute(
+            "SELECT MAX(offset + length) FROM records WHERE file = ?",
+            (self._filename,),
+        ).fetchone()[0]
+        path = os.path.join(self._directory, self._filename)
+        if end is not None and os.path.exists(path) and os.path.getsize(path) > end:
+            with open(path, "rb") as file:
+                file.seek(end)
+                self.__index_file(file, self._filename, end)
+            self.commit()
+
+    def __log_filenames(self) -> list[str]:
+        """The rotated log files in rotation order, then the current one"""
+        return sorted(
+            (
+                f
+                for f in os.listdir(self._directory or ".")
+                if re.fullmatch(re.escape(self._filename) + ROTATED_SUFFIX, f)
+            ),
+            key=_rotation_order,
+        ) + [self._filename]
+
+    def __index_file(self, file, filename: str, offset: int = 0):
+        record = None  # (offset, length, fields)
+        for line in file:
+            text = line.decode(errors="replace")
+            fields = _parse_line(text)
+            if fields is None and record is not None:
+                # continuation of a multi-line message
+                record = (record[0], record[1] + len(line), record[2])
+            else:
+                if record is not None:
+                    self.add(*record, filename=filename)
+                record = (offset, len(line), fields or {})
+            offset += len(line)
+        if record is not None:
+            self.add(*record, filename=filename)
+
+    @staticmethod
+    def __where(status, task, name, since, until) -> tuple[str, list]:
+        clauses, parameters = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            parameters.append(status.upper())
+        if task is not None:
+            clauses.append("task = ?")
+            parameters.append(task)
+        if name is not None:
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            escaped = re.sub(r"([\\%_])", r"\\\1", name)
+            parameters.append(f"%{escaped}%")
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            parameters.append(since)
+        if until is not None:
+            # a prefix such as '20250131' includes the whole day
+            clauses.append("timestamp <= ?")
+            parameters.append(until.ljust(14, "9"))
+        if not clauses:
+            return "", parameters
+        return " WHERE " + " AND ".join(clauses), parameters
+
+
+def _parse_line(text: str) -> dict | None:
+    """Parses the fields of a record line; returns None for continuation lines"""
+    if text.startswith("{"):
+        try:
+            return json.loads(text)
+        except ValueError:
+            return None
+    timestamp = text[:14]
+    if not timestamp.isdigit():
+        return None
+    parts = text.rstrip("\n").split(";", len(RECORD_FIELDS) + 2)
+    if len(parts) >= len(RECORD_FIELDS) + 2 and parts[1] in (
+        "SUCCESS",
+        "FAILURE",
+        "SKIPPED",
+    ):
+        fields = {"timestamp": timestamp, "status": parts[1]}
+        fields.update(zip(RECORD_FIELDS, parts[2:]))
+        return fields
+    return {"timestamp": timestamp}
+
+
+def log_command(argv: list[str]):
+    """Implements the 'log' subcommand: filter, count and tail log.txt via its index"""
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} log",
+        description="query the records of log.txt (including rotated files)",
+    )
+    parser.add_argument("directory", help="directory that contains log.txt")
+    parser.add_argument("--status", help="SUCCESS or FAILURE")
+    parser.add_argument("--task", help="task name")
+    parser.add_argument("--name", help="part of the model or file name")
+    parser.add_argument("--since", help="timestamp (prefix), e.g. 20250101")
+    parser.add_argument("--until", help="timestamp (prefix), e.g. 20250131")
+    parser.add_argument("--tail", type=int, help="only the last N matching records")
+    parser.add_argument("--count", action="store_true", help="only count records")
+    parser.add_argument(
+        "--reindex", action="store_true", help="rebuild the index from the log files"
+    )
+    args = parser.parse_args(argv)
+
+    log_path = os.path.join(args.directory, LOG_FILENAME)
+    if not os.path.exists(log_path + INDEX_SUFFIX) and not os.path.exists(log_path):
+        print(f"No {LOG_FILENAME} found in '{args.directory}'", file=sys.stderr)
+        sys.exit(1)
+
+    index = LogIndex(log_path)
+    # a running writer catches up on the records at the end itself, so only
+    # records from before the index existed are indexed here
+    if args.reindex or index.lacks_records():
+        index.rebuild()
+
+    filters = dict(
+        status=args.status,
+        task=args.task,
+        name=args.name,
+        since=args.since,
+        until=args.until,
+    )
+    if args.count:
+        print(index.count(**filters))
+    else:
+        for record in index.read(index.query(tail=args.tail, **filters)):
+            print(record)
+    index.close()
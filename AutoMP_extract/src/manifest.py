@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = "manifest.json"
+HASH_CHUNK_BYTES = 64 * 1024
+
+
+class Manifest:
+    """
+    Manifest maps every input file extracted into a directory to its size,
+    modification time, content hash and extraction result, so that later runs
+    only extract new or changed inputs. It is stored as 'manifest.json' in the
+    output directory. If the extraction settings differ from the ones of the
+    manifest, every input counts as changed.
+    """
+
+    def __init__(self, directory_out: str, settings: dict):
+        self._path = os.path.join(directory_out, MANIFEST_FILENAME)
+        self._settings = settings
+        self._entries: dict[str, dict] = {}
+        self._stale = False
+        if os.path.exists(self._path):
+            with open(self._path, "r") as file:
+                data = json.load(file)
+            self._entries = data["inputs"]
+            self._stale = data.get("settings") != settings
+
+    def get(self, filepath: str) -> dict | None:
+        entry = self._entries.get(os.path.abspath(filepath))
+        if entry is not None and self._stale:
+            # keeps the output (to be replaced) but never matches a hash
+            return {**entry, "hash": None}
+        return entry
+
+    def is_unchanged(self, filepath: str, size: int, mtime_ns: int) -> bool:
+        """Cheap check by size and modification time, without reading the file"""
+        entry = self.get(filepath)
+        return (
+            not self._stale
+            and entry is not None
+            and entry["size"] == size
+            and entry["mtime_ns"] == mtime_ns
+        )
+
+    def update(self, filepath: str, entry: dict):
+        self._entries[os.path.abspath(filepath)] = entry
+
+    def save(self):
+        with open(f"{self._path}.tmp", "w") as file:
+            json.dump({"settings": self._settings, "inputs": self._entries}, file)
+        os.replace(f"{self._path}.tmp", self._path)
+
+
+def hash_file(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,64 @@
+import os
+import subprocess
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+PRECHECK_TIMEOUT_SECONDS = 30
+PRECHECK_OUTPUT_LIMIT = 2000
+
+
+def precheck(compiler: str, code: str) -> tuple[bool, str]:
+    """Checks the syntax of a C program with '<compiler> -fsyntax-only -fopenmp'"""
+    try:
+        process = subprocess.run(
+            [compiler, "-fsyntax-only", "-fopenmp", "-x", "c", "-"],
+            input=code,
+            capture_output=True,
+            text=True,
+            timeout=PRECHECK_TIMEOUT_SECONDS,
+        )
+    except subprocess.TimeoutExpired:
+        return False, "timeout"
+    return process.returncode == 0, process.stderr[:PRECHECK_OUTPUT_LIMIT]
+
+
+def prechecked(extractions, compiler: str):
+    """
+    Runs the syntax pre-check of every extracted C program on a thread pool
+    (the compilers run in parallel) and yields the extractions in their
+    original order, tagged in their manifest entry and log message
+    """
+    workers = os.cpu_count() or 1
+    with ThreadPoolExecutor(workers) as executor:
+        pending: deque[tuple[object, Future | None]] = deque()
+        for extraction in extractions:
+            future = None
+            if extraction.code is not None and extraction.entry["output"].endswith(
+                ".c"
+            ):
+                future = executor.submit(precheck, compiler, extraction.code)
+            pending.append((extraction, future))
+            while len(pending) > 2 * workers:
+                yield _tag(*pending.popleft())
+        while pending:
+            yield _tag(*pending.popleft())
+
+
+def _tag(extraction, future: Future | None):
+    if future is None:
+        return extraction
+    passed, output = future.result()
+    extraction.entry["precheck"] = passed
+    if not passed:
+        extraction.entry["precheck_output"] = output
+        error = _first_error(output)
+        extraction.message += f" (syntax pre-check failed: {error})"
+        extraction.console += f" [red](syntax pre-check failed: {error})[/red]"
+    return extraction
+
+
+def _first_error(output: str) -> str:
+    for line in output.splitlines():
+        if "error" in line:
+            return line.strip()
+    return output.strip().split("\n")[0] if output.strip() else "no output"
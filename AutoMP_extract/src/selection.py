@@ -0,0 +1,150 @@
+import math
+import re
+from dataclasses import dataclass
+
+from .extract import CodeBlock
+
+C_LANGUAGES = ["c", "", "h", "cpp", "c++"]
+SNIPPET_LANGUAGES = ["sh", "bash", "shell", "console", "text", "output", "makefile"]
+MAIN_PATTERN = re.compile(r"\bmain\s*\(")
+OMP_PATTERN = re.compile(r"#\s*pragma\s+omp\b")
+INCLUDE_PATTERN = re.compile(r"^\s*#\s*include\b")
+# name of a function definition such as 'static int sum(int *a, int n) {'
+FUNCTION_DEFINITION = re.compile(
+    r"^[A-Za-z_][\w \t\*]*?\b([A-Za-z_]\w*)\s*\([^;{]*\)\s*\{", re.MULTILINE
+)
+
+
+@dataclass
+class SelectionOptions:
+    strategy: str = "score"
+    flags_macro: str | None = None
+    reassemble: bool = False
+
+
+@dataclass
+class Selection:
+    block: CodeBlock
+    rationale: str
+
+
+def select_block(code_blocks: list[CodeBlock], options: SelectionOptions) -> Selection:
+    """Chooses the code block to extract with the configured strategy"""
+    candidates = [(block, f"block {i + 1}") for i, block in enumerate(code_blocks)]
+    if options.reassemble:
+        reassembled = _reassemble(code_blocks)
+        if reassembled is not None:
+            candidates.append(reassembled)
+    block, label, rationale = STRATEGIES[options.strategy](candidates, options)
+    if len(code_blocks) == 1 and len(candidates) == 1:
+        return Selection(block, f"found one code block{rationale}")
+    return Selection(
+        block, f"found {len(code_blocks)} code blocks, chose {label}{rationale}"
+    )
+
+
+def extension(block: CodeBlock) -> str:
+    return block.language if block.language != "" else "c"
+
+
+def _select_first(candidates, options: SelectionOptions):
+    return *candidates[0], " (first)"
+
+
+def _select_last(candidates, options: SelectionOptions):
+    return *candidates[-1], " (last)"
+
+
+def _select_score(candidates, options: SelectionOptions):
+    scored = [_score(block, options) for block, _ in candidates]
+    # ties go to the later candidate, like the 'last' strategy
+    best = max(range(len(candidates)), key=lambda i: (scored[i][0], i))
+    score, reasons = scored[best]
+    return (
+        *candidates[best],
+        f" (score {round(score, 1)}: {', '.join(reasons)})",
+    )
+
+
+def _score(block: CodeBlock, options: SelectionOptions) -> tuple[float, list[str]]:
+    """Scores how likely a block is the complete OpenMP program"""
+    score = 0.0
+    reasons = [f"language '{block.language}'"]
+    language = block.language.lower()
+    if language == "c":
+        score += 3
+    elif language in C_LANGUAGES:
+        score += 2
+    elif language in SNIPPET_LANGUAGES:
+        score -= 5
+    else:
+        score -= 2
+    if MAIN_PATTERN.search(block.code):
+        score += 5
+        reasons.append("main(")
+    if OMP_PATTERN.search(block.code):
+        score += 3
+        reasons.append("#pragma omp")
+    if options.flags_macro is not None and options.flags_macro in block.code:
+        score += 2
+        reasons.append(options.flags_macro)
+    # longer blocks win between otherwise equal candidates, with diminishing returns
+    score += math.log10(1 + block.length) / 2
+    reasons.append(f"{block.length} chars")
+    if not block.terminated:
+        score -= 1
+        reasons.append("unterminated")
+    return score, reasons
+
+
+def _reassemble(code_blocks: list[CodeBlock]) -> tuple[CodeBlock, str] | None:
+    """
+    Merges a program that is split across C blocks: the block with the main
+    function, preceded by the blocks that define functions it calls without
+    defining them itself
+    """
+    indices = [
+        i for i, b in enumerate(code_blocks) if b.language.lower() in C_LANGUAGES
+    ]
+    mains = [i for i in indices if MAIN_PATTERN.search(code_blocks[i].code)]
+    if len(mains) != 1:
+        return None
+    main_code = code_blocks[mains[0]].code
+    defined = set(FUNCTION_DEFINITION.findall(main_code))
+
+    helpers = []
+    for i in indices:
+        names = set(FUNCTION_DEFINITION.findall(code_blocks[i].code)) - defined
+        if i != mains[0] and any(
+            re.search(rf"\b{name}\s*\(", main_code) for name in names
+        ):
+            helpers.append(i)
+    if not helpers:
+        return None
+
+    # includes first, then the helpers, so that main sees their definitions
+    parts = helpers + mains
+    includes, bodies = [], []
+    for i in parts:
+        body = []
+        for line in code_blocks[i].code.split("\n"):
+            if INCLUDE_PATTERN.match(line) is None:
+                body.append(line)
+            elif line not in includes:
+                includes.append(line)
+        bodies.append("\n".join(body).strip("\n"))
+    code = "\n".join(includes) + "\n\n" + "\n\n".join(bodies)
+    block = CodeBlock(
+        code_blocks[mains[0]].language,
+        code,
+        len(code),
+        all(code_blocks[i].terminated for i in parts),
+    )
+    return block, f"blocks {', '.join(str(i + 1) for i in sorted(parts))} reassembled"
+
+
+STRATEGIES = {
+    "score": _select_score,
+    "last": _select_last,
+    "first": _select_first,
+}
@@ -1,9 +1,95 @@
 import os
+import shutil
+import sys
 
-from .log import Log
+from .dedup import DEDUP_MODES
+from .harness import HARNESS_MODES
+from .log import FSYNC_POLICIES, LEVELS, LOG_FORMATS, ROTATION_INTERVALS, Log
+from .pack import is_pack
+from .selection import STRATEGIES
 
 
 class Validator:
+    @staticmethod
+    def pop_option(argv: list[str], name: str) -> str | None:
+        """Removes '<name> <value>' from argv and returns the value, or None if absent"""
+        if name not in argv:
+            return None
+        index = argv.index(name)
+        if index + 1 >= len(argv):
+            Log.error(f"Option '{name}' requires a value")
+            sys.exit(1)
+        value = argv[index + 1]
+        del argv[index : index + 2]
+        return value
+
+    @staticmethod
+    def pop_flag(argv: list[str], name: str) -> bool:
+        """Removes '<name>' from argv and returns whether it was present"""
+        if name not in argv:
+            return False
+        argv.remove(name)
+        return True
+
+    @staticmethod
+    def log_options(log_format: str, log_fsync: str, log_level: str) -> bool:
+        for option, value, allowed in [
+            ("--log-format", log_format, LOG_FORMATS),
+            ("--log-fsync", log_fsync, FSYNC_POLICIES),
+            ("--log-level", log_level, list(LEVELS.keys())),
+        ]:
+            if value not in allowed:
+                Log.error(f"Option '{option}' must be one of {', '.join(allowed)}")
+                return False
+        return True
+
+    @staticmethod
+    def log_rotation(max_bytes: str | None, interval: str | None) -> bool:
+        if max_bytes is not None and (not max_bytes.isdigit() or int(max_bytes) == 0):
+            Log.error("Option '--log-max-bytes' must be a positive integer")
+            return False
+        if interval is not None and interval not in ROTATION_INTERVALS:
+            Log.error(
+                f"Option '--log-rotate' must be one of {', '.join(ROTATION_INTERVALS)}"
+            )
+            return False
+        return True
+
+    @staticmethod
+    def jobs(jobs: str) -> bool:
+        if not jobs.isdigit() or int(jobs) == 0:
+            Log.error("Option '--jobs' must be a positive integer")
+            return False
+        return True
+
+    @staticmethod
+    def selection(strategy: str) -> bool:
+        if strategy not in STRATEGIES:
+            Log.error(f"Option '--select' must be one of {', '.join(STRATEGIES)}")
+            return False
+        return True
+
+    @staticmethod
+    def dedup(mode: str) -> bool:
+        if mode not in DEDUP_MODES:
+            Log.error(f"Option '--dedup' must be one of {', '.join(DEDUP_MODES)}")
+            return False
+        return True
+
+    @staticmethod
+    def harness(mode: str) -> bool:
+        if mode not in HARNESS_MODES:
+            Log.error(f"Option '--harness' must be one of {', '.join(HARNESS_MODES)}")
+            return False
+        return True
+
+    @staticmethod
+    def precheck(compiler: str) -> bool:
+        if shutil.which(compiler) is None:
+            Log.error(f"Compiler '{compiler}' for '--precheck' not found")
+            return False
+        return True
+
     @staticmethod
     def single(argv: list[str]) -> bool:
         if len(argv) < 4:
@@ -40,8 +126,8 @@ class Validator:
         if not os.path.exists(directory_in):
             Log.error(f"Directory '{directory_in}' does not exist")
             return False
-        if not os.path.isdir(directory_in):
-            Log.error(f"'{directory_in}' is not a directory")
+        if not os.path.isdir(directory_in) and not is_pack(directory_in):
+            Log.error(f"'{directory_in}' is neither a directory nor a pack")
             return False
         if not os.path.exists(directory_out):
             Log.error(f"Directory '{directory_out}' does not exist")
@@ -58,5 +144,36 @@ class Validator:
                 "Usage: python automp_extract.py watch <directory_in> <directory_out>"
             )
             return False
+        if is_pack(argv[2]):
+            Log.error("'watch' needs a directory, not a pack")
+            return False
 
         return Validator.multiple(argv)
+
+    @staticmethod
+    def pack(argv: list[str]) -> bool:
+        if len(argv) < 4:
+            Log.error("Usage: python automp_extract.py pack <directory_in> <pack>")
+            return False
+
+        directory_in = argv[2]
+        pack_path = argv[3]
+
+        if not os.path.isdir(directory_in):
+            Log.error(f"'{directory_in}' is not a directory")
+            return False
+        if os.path.exists(pack_path) and not is_pack(pack_path):
+            Log.error(f"'{pack_path}' exists and is not a pack")
+            return False
+        return True
+
+    @staticmethod
+    def pack_output(pack_path: str, dedup_mode: str | None) -> bool:
+        if os.path.exists(pack_path) and not is_pack(pack_path):
+            Log.error(f"'{pack_path}' exists and is not a pack")
+            return False
+        if dedup_mode in ("link", "reference"):
+            # both replace files on the file system
+            Log.error("Option '--pack' only supports '--dedup copy'")
+            return False
+        return True
@@ -0,0 +1,123 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Iterator
+
+from .log import Log
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# a file is handed out once it had no new events for this long
+WATCH_DEBOUNCE_SECONDS = 0.5
+WATCH_POLL_INTERVAL_SECONDS = 2
+WATCH_READ_BYTES = 64 * 1024
+
+
+def watch_files(directory: str) -> Iterator[str]:
+    """
+    Yields the paths of files in the directory as they are finished: after the
+    writer closed them (IN_CLOSE_WRITE) or moved them in (IN_MOVED_TO), and no
+    further event arrived within WATCH_DEBOUNCE_SECONDS. Uses inotify where
+    available and falls back to polling, where a file counts as finished once
+    its size and modification time are unchanged between two scans. Files
+    that exist when watching starts are yielded first.
+    """
+    fd = _inotify_watch(directory)
+    if fd is None:
+        Log.info(f"inotify not available, polling every {WATCH_POLL_INTERVAL_SECONDS}s")
+        yield from _poll(directory)
+    else:
+        try:
+            # only after the watch is set up, so that no file falls in between
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    yield entry.path
+            yield from _inotify(directory, fd)
+        finally:
+            os.close(fd)
+
+
+def _inotify_watch(directory: str) -> int | None:
+    library = ctypes.util.find_library("c")
+    if library is None:
+        return None
+    libc = ctypes.CDLL(library, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+    if (
+        libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        < 0
+    ):
+        os.close(fd)
+        return None
+    return fd
+
+
+def _inotify(directory: str, fd: int) -> Iterator[str]:
+    pending: dict[str, float] = {}  # name -> time of the last event
+    while True:
+        timeout = None
+        if pending:
+            timeout = max(
+                0.0, min(pending.values()) + WATCH_DEBOUNCE_SECONDS - time.monotonic()
+            )
+        readable, _, _ = select.select([fd], [], [], timeout)
+
+        if readable:
+            data = os.read(fd, WATCH_READ_BYTES)
+            now = time.monotonic()
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost, so every file is a candidate again
+                    for entry in os.scandir(directory):
+                        if entry.is_file():
+                            pending[entry.name] = now
+                elif name:
+                    pending[os.fsdecode(name)] = now
+
+        now = time.monotonic()
+        for name, last_event in list(pending.items()):
+            if now - last_event >= WATCH_DEBOUNCE_SECONDS:
+                del pending[name]
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    yield path
+
+
+def _poll(directory: str) -> Iterator[str]:
+    seen: dict[str, tuple[int, int]] = {}  # name -> (size, mtime) when yielded
+    previous: dict[str, tuple[int, int]] = {}
+    while True:
+        current = _scan(directory)
+        for name, signature in current.items():
+            if previous.get(name) == signature and seen.get(name) != signature:
+                seen[name] = signature
+                yield os.path.join(directory, name)
+        previous = current
+        time.sleep(WATCH_POLL_INTERVAL_SECONDS)
+
+
+def _scan(directory: str) -> dict[str, tuple[int, int]]:
+    signatures = {}
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            signatures[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return signatures
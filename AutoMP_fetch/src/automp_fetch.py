@@ -2,36 +2,69 @@ import json
 import os
 import signal
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from cron_descriptor import get_description
 from croniter import croniter
 
 import src.cron as cron
+from src.config import SHUTDOWN_DEADLINE_MARGIN_SECONDS
 from src.job import Job
+from src.keypool import KeyPool
+from src.latency import LatencyHistory
 from src.log import Log
-from src.models import Models
+from src.metrics import Metrics
+from src.models import Models, QueryResult
 from src.pushover import Pushover
+from src.scheduler import get_max_workers, order_work, submit_bounded
+from src.tracing import Profiler, Trace
 
 
 class AutoMP_fetch:
     def __init__(self, config_file_dir, data):
+        self._acting = False
+        self._shutdown_requested = False
+        self._shutdown_timer: threading.Timer | None = None
+        self._pair_lock = threading.Lock()
         signal.signal(signal.SIGINT, self.__early_shutdown)
+        signal.signal(signal.SIGTERM, self.__early_shutdown)
 
         self._job = Job(config_file_dir, data)
+        Log.configure_logfile(
+            self._job.get_log_format(),
+            self._job.get_log_fsync(),
+            self._job.get_log_rotation_max_bytes(),
+            self._job.get_log_rotation_interval(),
+            self._job.get_log_rotation_compress(),
+        )
+        # 'debug: true' is short for 'log-level: debug'
+        Log.set_level("debug" if self._job.get_debug() else self._job.get_log_level())
         Log.logfile_write(self._job.get_log_directory(), "started")
-        Log.set_debug_mode(self._job.get_debug())
         if self._job.get_notifications_active():
             self._pushover = Pushover(self._job)
             self._pushover.perform_check()
-        self._models = Models(self._job)
+        self._history = LatencyHistory(self._job.get_log_directory())
+        self._keys = KeyPool(self._job.get_openrouter_api_keys())
+        self._metrics = Metrics()
+        if self._job.has_metrics_port():
+            self._metrics.serve(
+                self._job.get_metrics_host(), self._job.get_metrics_port()
+            )
+        if self._job.has_metrics_textfile():
+            self._metrics.write_periodically(
+                self._job.get_metrics_textfile(), self._job.get_metrics_interval()
+            )
+        self._models = Models(self._job, self._history, self._keys, self._metrics)
 
         self._iterations = 0
 
         if self._job.get_repeat() is None:
             Log.info("Running once")
             self.__act(datetime.now())
+            if self._shutdown_requested:
+                self.__shutdown()
             self.__end()
         else:
             self._models.perform_check()  # we do not need a check if we only query once
@@ -55,9 +88,12 @@ class AutoMP_fetch:
                 Log.info("Next run is past repeat end")
                 self.__end()
             Log.info(f"Next run: {self._croniter.get_next(datetime, datetime.now())}")
+            self._metrics.set_next_tick(next_run)
             cron.wait_for_datetime(next_run)
             self._iterations += 1
             self.__act(next_run)
+            if self._shutdown_requested:
+                self.__shutdown()
             if (
                 self._job.has_repeat_count()
                 and self._iterations >= self._job.get_repeat_count()
@@ -65,9 +101,28 @@ class AutoMP_fetch:
                 Log.info("Repeat count reached")
                 self.__end()
 
+    @Trace.traced("AutoMP_fetch.__act")
     def __act(self, timestamp: datetime):
+        queries_per_task = len(self._job.get_models()) * self._job.get_samples()
+        self._remaining = {
+            task["name"]: queries_per_task for task in self._job.get_tasks()
+        }
+        self._succeeded = {task["name"]: 0 for task in self._job.get_tasks()}
+        self._pair_valid: dict[tuple[str, str], int] = {}
+        self._pair_attempts: dict[tuple[str, str], int] = {}
+
+        # generated lazily, prompts are only assembled once a query starts
+        work = order_work(
+            self._job.get_tasks(),
+            self._job.get_models(),
+            self._job.get_samples(),
+            self._job.get_scheduling(),
+            self._history,
+        )
+
         with Log.progress() as progress:
-            total_queries = len(self._job.get_tasks()) * len(self._job.get_models())
+            total_queries = len(self._job.get_tasks()) * queries_per_task
+            self._metrics.set_queued(total_queries)
             progress_bar_task = progress.add_task(
                 Log.get_description(
                     self._iterations, self._job.get_repeat_count(), total_queries
@@ -75,34 +130,126 @@ class AutoMP_fetch:
                 total=total_queries,
             )
 
-            if self._job.get_threading():
-                futures = []
-                with ThreadPoolExecutor() as executor:
-                    for task in self._job.get_tasks():
-                        for model in self._job.get_models():
-                            futures.append(
-                                executor.submit(
-                                    self._models.query,
-                                    model,
-                                    timestamp,
-                                    task["name"],
-                                    task["prompt"],
-                                    task["code"],
-                                )
-                            )
-                    for future in as_completed(futures):
-                        future.result()
-                        progress.update(progress_bar_task, advance=1)
-            else:
-                for task in self._job.get_tasks():
-                    for model in self._job.get_models():
-                        self._models.query(
-                            model, timestamp, task["name"], task["prompt"], task["code"]
-                        )
+            self._acting = True
+            try:
+                if self._job.get_threading():
+                    with ThreadPoolExecutor(max_workers=get_max_workers()) as executor:
+                        for (task, _, _), future in submit_bounded(
+                            self.__until_shutdown(work),
+                            lambda item: executor.submit(self.__query, timestamp, item),
+                        ):
+                            result = future.result()
+                            if result is None:
+                                continue
+                            self.__complete(timestamp, task["name"], result)
+                            progress.update(progress_bar_task, advance=1)
+                else:
+                    for item in self.__until_shutdown(work):
+                        result = self.__query(timestamp, item)
+                        if result is None:
+                            break
+                        self.__complete(timestamp, item[0]["name"], result)
                         progress.update(progress_bar_task, advance=1)
+            finally:
+                self._acting = False
+                # the in-flight queries are done, nothing is left to cancel
+                if self._shutdown_timer is not None:
+                    self._shutdown_timer.cancel()
+                    self._shutdown_timer = None
+            self._metrics.set_queued(0)
 
+        self._history.save()
+        if self._job.has_target_successes():
+            self.__report_pairs(timestamp)
         self.__check_stats_and_notify(timestamp)
 
+    def __until_shutdown(self, work):
+        for item in work:
+            if self._shutdown_requested:
+                return
+            yield item
+
+    def __query(self, timestamp: datetime, item: tuple) -> QueryResult | None:
+        """
+        Runs a work item; returns None if it was dropped because of a shutdown.
+        Items of a (task, model) pair that already reached target-successes
+        are skipped without a request.
+        """
+        if self._shutdown_requested:
+            self._metrics.query_dropped()
+            return None
+        task, model, sample = item
+        pair = (task["name"], model)
+        if self.__pair_satisfied(pair):
+            self._metrics.query_dropped()
+            return QueryResult(message="target reached", skipped=True)
+
+        self._metrics.query_started()
+        result = self._models.query(
+            model,
+            timestamp,
+            task["name"],
+            task["prompt"],
+            task["code"],
+            sample,
+            # no retries once shutting down, so a query takes at most one timeout
+            lambda: self._shutdown_requested or self.__pair_satisfied(pair),
+        )
+        if result.skipped and self._shutdown_requested:
+            result.message = "shutting down"
+        self._metrics.query_finished(
+            model,
+            "skipped" if result.skipped else "success" if result.success else "failure",
+        )
+        with self._pair_lock:
+            self._pair_attempts[pair] = (
+                self._pair_attempts.get(pair, 0) + result.attempts
+            )
+            if result.valid:
+                self._pair_valid[pair] = self._pair_valid.get(pair, 0) + 1
+        return result
+
+    def __pair_satisfied(self, pair: tuple[str, str]) -> bool:
+        return (
+            self._job.has_target_successes()
+            and self._pair_valid.get(pair, 0) >= self._job.get_target_successes()
+        )
+
+    def __report_pairs(self, timestamp: datetime):
+        timestamp_str = timestamp.strftime("%Y%m%d%H%M%S")
+        satisfied = 0
+        for task in self._job.get_tasks():
+            for model in self._job.get_models():
+                pair = (task["name"], model)
+                valid = self._pair_valid.get(pair, 0)
+                attempts = self._pair_attempts.get(pair, 0)
+                satisfied += valid >= self._job.get_target_successes()
+                message = f"{valid}/{self._job.get_target_successes()} valid after {attempts} attempt{'s' if attempts != 1 else ''}"
+                Log.debug("Task '%s' with model '%s': %s", task["name"], model, message)
+                Log.logfile_write(
+                    self._job.get_log_directory(),
+                    f"pair {timestamp_str}__{task['name']}__{model}: {message}",
+                )
+        pairs = len(self._job.get_tasks()) * len(self._job.get_models())
+        Log.info(
+            f"Target reached for {satisfied}/{pairs} task/model pairs using {sum(self._pair_attempts.values())} requests"
+        )
+
+    def __complete(self, timestamp: datetime, task_name: str, result: QueryResult):
+        """Reports a task as soon as all of its queries have finished"""
+        self._remaining[task_name] -= 1
+        if result.success and not result.skipped:
+            self._succeeded[task_name] += 1
+        if self._remaining[task_name] > 0:
+            return
+
+        summary = f"{self._succeeded[task_name]}/{len(self._job.get_models()) * self._job.get_samples()} successful"
+        Log.info(f"Task '{task_name}' completed ({summary})")
+        Log.logfile_write(
+            self._job.get_log_directory(),
+            f"completed task {timestamp.strftime('%Y%m%d%H%M%S')}__{task_name} ({summary})",
+        )
+
     def __check_stats_and_notify(self, timestamp: datetime):
         timestamp_str = timestamp.strftime("%Y%m%d%H%M%S")
         paths = [
@@ -115,6 +262,7 @@ class AutoMP_fetch:
             return
 
         success_count = 0
+        provider_seconds: dict[str, list[float]] = {}
         for path in paths:
             with open(os.path.join(self._job.get_log_directory(), path), "r") as file:
                 data = json.load(file)
@@ -122,6 +270,11 @@ class AutoMP_fetch:
                 "parsing_success", False
             ):
                 success_count += 1
+                openrouter = data.get("openrouter")
+                if isinstance(openrouter, dict) and "provider" in openrouter:
+                    provider_seconds.setdefault(openrouter["provider"], []).append(
+                        data["request_seconds"]
+                    )
 
         message = Log.get_summary(
             self._iterations, self._job.get_repeat_count(), success_count, total
@@ -140,13 +293,70 @@ class AutoMP_fetch:
                 self._pushover.send(message)
             Log.info(message)
 
+        for provider, seconds in sorted(provider_seconds.items()):
+            Log.info(Log.get_provider_summary(provider, seconds))
+
+        if len(self._job.get_openrouter_api_keys()) > 1:
+            for line in self._keys.get_summary():
+                Log.info(line)
+
     def __early_shutdown(self, signum, frame):
+        """
+        Outside of an iteration, shuts down right away. During an iteration,
+        the first signal stops scheduling new queries and lets the in-flight
+        ones finish and be written, for at most shutdown-deadline seconds (by
+        default, a margin above the largest request timeout of the models);
+        a second signal (or the deadline) cancels them.
+        """
+        print()
+        if not self._acting:
+            self.__shutdown()
+
+        if self._shutdown_requested:
+            self.__cancel()
+
+        self._shutdown_requested = True
+        deadline = self.__get_shutdown_deadline()
+        Log.info(
+            f"Shutting down gracefully, waiting up to {round(deadline)}s for in-flight queries (signal again to cancel)..."
+        )
+        self._shutdown_timer = threading.Timer(deadline, self.__cancel_if_acting)
+        self._shutdown_timer.daemon = True
+        self._shutdown_timer.start()
+
+    def __get_shutdown_deadline(self) -> float:
+        deadline = self._job.get_shutdown_deadline()
+        if deadline is not None:
+            return deadline
+        return (
+            max(self._models.get_timeout(model) for model in self._job.get_models())
+            + SHUTDOWN_DEADLINE_MARGIN_SECONDS
+        )
+
+    def __shutdown(self):
         if self._job.get_notifications_active():
             self._pushover.send("AutoMP_fetch is shutting down")
-        print()
         Log.info("Shutting down gracefully...")
+        Log.logfile_write(self._job.get_log_directory(), "shut down")
         sys.exit(0)
 
+    def __cancel_if_acting(self):
+        # the timer may fire right before __act cancels it
+        if self._acting:
+            self.__cancel()
+
+    def __cancel(self):
+        Log.error("Cancelling in-flight queries")
+        Log.logfile_write(self._job.get_log_directory(), "cancelled")
+        self._history.save()
+        if self._job.get_notifications_active():
+            self._pushover.send("AutoMP_fetch cancelled in-flight queries")
+        Log.close()
+        Trace.save()
+        Profiler.save()
+        # worker threads cannot be interrupted, so exit without joining them
+        os._exit(1)
+
     def __end(self):
         if self._job.get_notifications_active():
             self._pushover.send("AutoMP_fetch is done")
@@ -1,3 +1,23 @@
 QUERY_TIMEOUT_SECONDS = 30
+TIMEOUT_PERCENTILE = 99
+TIMEOUT_MARGIN = 1.5
+TIMEOUT_FLOOR_SECONDS = 5
+TIMEOUT_CEILING_SECONDS = 300
+TIMEOUT_MIN_SAMPLES = 5
 TEST_QUERY = "RETURN THE WORD 'TEST'"
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+LATENCY_HISTORY_FILENAME = "latency.json"
+LATENCY_HISTORY_SIZE = 100
+SCHEDULING_POLICIES = ["task-order", "longest-first", "round-robin"]
+PROVIDER_MIN_RELIABILITY = 0.9
+KEY_COOLDOWN_SECONDS = 10
+# 403 also rejects single requests (e.g. moderation), so it is not a key problem
+KEY_EXHAUSTED_STATUS_CODES = [401, 402]
+SUBMISSION_QUEUE_FACTOR = 2
+SHUTDOWN_DEADLINE_MARGIN_SECONDS = 10
+CODE_FENCE_PATTERN = r"^ {0,3}(```|~~~)"
+RESPONSE_SPOOL_BYTES = 1024 * 1024
+RESPONSE_CHUNK_BYTES = 64 * 1024
+METRICS_HOST = "127.0.0.1"
+METRICS_TEXTFILE_INTERVAL_SECONDS = 15
+METRICS_LATENCY_BUCKETS = [1, 2, 5, 10, 20, 30, 60, 90, 120, 180, 300]
@@ -1,6 +1,16 @@
 import os
 from datetime import datetime
 
+from src.config import (
+    METRICS_HOST,
+    METRICS_TEXTFILE_INTERVAL_SECONDS,
+    QUERY_TIMEOUT_SECONDS,
+    TIMEOUT_CEILING_SECONDS,
+    TIMEOUT_FLOOR_SECONDS,
+    TIMEOUT_MARGIN,
+    TIMEOUT_PERCENTILE,
+)
+
 
 class Job:
     """
@@ -37,6 +47,26 @@ class Job:
         self._threading = data.get("threading", False)
         self._debug = data.get("debug", False)
         self._max_attempts = data.get("max-attempts", 3)
+        self._scheduling = data.get("scheduling", "task-order")
+        self._timeout = data.get("timeout", {})
+        self._provider_routing = data.get("provider-routing", False)
+        self._samples = data.get("samples", 1)
+        self._target_successes = data.get("target-successes", None)
+        self._log_format = data.get("log-format", "text")
+        self._log_fsync = data.get("log-fsync", "never")
+        self._log_level = data.get("log-level", "info")
+        self._log_rotation = data.get("log-rotation", {})
+        self._metrics = data.get("metrics", None)
+        if self._metrics is not None and "textfile" in self._metrics:
+            if os.path.isabs(self._metrics["textfile"]):
+                self._metrics_textfile = self._metrics["textfile"]
+            else:
+                self._metrics_textfile = os.path.abspath(
+                    os.path.join(config_file_dir, self._metrics["textfile"])
+                )
+        else:
+            self._metrics_textfile = None
+        self._shutdown_deadline = data.get("shutdown-deadline", None)
 
         tasks = []
         for task, content in self._input.items():
@@ -64,8 +94,10 @@ class Job:
     def get_debug(self):
         return self._debug
 
-    def get_openrouter_api_key(self):
-        return self._openrouter_api_key
+    def get_openrouter_api_keys(self) -> list[str]:
+        if isinstance(self._openrouter_api_key, list):
+            return self._openrouter_api_key
+        return [self._openrouter_api_key]
 
     def get_input_directive(self):
         return self._input_directive
@@ -125,3 +157,78 @@ class Job:
 
     def get_max_attempts(self):
         return self._max_attempts
+
+    def get_scheduling(self):
+        return self._scheduling
+
+    def get_timeout_default(self):
+        return self._timeout.get("default", QUERY_TIMEOUT_SECONDS)
+
+    def get_timeout_adaptive(self):
+        return self._timeout.get("adaptive", True)
+
+    def get_timeout_percentile(self):
+        return self._timeout.get("percentile", TIMEOUT_PERCENTILE)
+
+    def get_timeout_margin(self):
+        return self._timeout.get("margin", TIMEOUT_MARGIN)
+
+    def get_timeout_floor(self):
+        return self._timeout.get("floor", TIMEOUT_FLOOR_SECONDS)
+
+    def get_timeout_ceiling(self):
+        return self._timeout.get("ceiling", TIMEOUT_CEILING_SECONDS)
+
+    def get_timeout_overrides(self) -> dict[str, float]:
+        return self._timeout.get("overrides", {})
+
+    def get_provider_routing(self):
+        return self._provider_routing
+
+    def get_samples(self):
+        return self._samples
+
+    def get_shutdown_deadline(self):
+        return self._shutdown_deadline
+
+    def has_target_successes(self):
+        return self._target_successes is not None
+
+    def get_target_successes(self):
+        return self._target_successes
+
+    def has_metrics_port(self):
+        return self._metrics is not None and "port" in self._metrics
+
+    def get_metrics_port(self):
+        return self._metrics["port"]
+
+    def get_metrics_host(self):
+        return self._metrics.get("host", METRICS_HOST)
+
+    def has_metrics_textfile(self):
+        return self._metrics_textfile is not None
+
+    def get_metrics_textfile(self):
+        return self._metrics_textfile
+
+    def get_metrics_interval(self):
+        return self._metrics.get("interval", METRICS_TEXTFILE_INTERVAL_SECONDS)
+
+    def get_log_format(self):
+        return self._log_format
+
+    def get_log_fsync(self):
+        return self._log_fsync
+
+    def get_log_level(self):
+        return self._log_level
+
+    def get_log_rotation_max_bytes(self):
+        return self._log_rotation.get("max-bytes", None)
+
+    def get_log_rotation_interval(self):
+        return self._log_rotation.get("interval", None)
+
+    def get_log_rotation_compress(self):
+        return self._log_rotation.get("compress", True)
@@ -0,0 +1,22 @@
+import json
+from typing import IO, Any
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library is the fallback
+    orjson = None
+
+
+def load(file: IO[bytes]) -> Any:
+    """Reads the whole file and parses it, orjson has no incremental parser"""
+    if orjson is not None:
+        return orjson.loads(file.read())
+    return json.load(file)
+
+
+def dump(data: Any, file: IO[bytes]):
+    # orjson only supports an indentation of 2, the standard library keeps 4
+    if orjson is not None:
+        file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        file.write(json.dumps(data, indent=4).encode())
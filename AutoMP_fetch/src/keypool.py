@@ -0,0 +1,88 @@
+import threading
+import time
+
+from src.config import KEY_COOLDOWN_SECONDS, KEY_EXHAUSTED_STATUS_CODES
+from src.log import Log
+
+
+class KeyPool:
+    """
+    KeyPool spreads requests over several OpenRouter API keys. It tracks the
+    usage of every key, sets a key aside for a cooldown when it is rate
+    limited (HTTP 429) and for the rest of the run when it is invalid or out
+    of credits (HTTP 401, 402). Other errors, such as a 403 for a request
+    rejected by moderation, only fail that request.
+    """
+
+    def __init__(self, keys: list[str]):
+        self._keys = keys
+        self._lock = threading.Condition()
+        self._in_flight = {key: 0 for key in keys}
+        self._requests = {key: 0 for key in keys}
+        self._throttled = {key: 0 for key in keys}
+        self._cooldown_until = {key: 0.0 for key in keys}
+        self._exhausted: set[str] = set()
+
+    @staticmethod
+    def redact(key: str) -> str:
+        if len(key) <= 12:
+            return "***"
+        return f"{key[:8]}...{key[-4:]}"
+
+    def acquire(self) -> str | None:
+        """
+        Returns the available key with the fewest requests in flight, waiting
+        for a cooldown to end if every key is throttled. Returns None if every
+        key is exhausted.
+        """
+        with self._lock:
+            while True:
+                usable = [key for key in self._keys if key not in self._exhausted]
+                if not usable:
+                    return None
+
+                now = time.time()
+                available = [key for key in usable if self._cooldown_until[key] <= now]
+                if available:
+                    key = min(
+                        available,
+                        key=lambda k: (self._in_flight[k], self._requests[k]),
+                    )
+                    self._in_flight[key] += 1
+                    self._requests[key] += 1
+                    return key
+
+                self._lock.wait(min(self._cooldown_until[k] for k in usable) - now)
+
+    def release(self, key: str, status_code: int | None, retry_after: str | None):
+        with self._lock:
+            self._in_flight[key] -= 1
+            if status_code == 429:
+                self._throttled[key] += 1
+                try:
+                    cooldown = float(retry_after)
+                except (TypeError, ValueError):
+                    cooldown = KEY_COOLDOWN_SECONDS
+                self._cooldown_until[key] = time.time() + cooldown
+                Log.debug(
+                    "API key %s rate limited, setting aside for %ss",
+                    KeyPool.redact(key),
+                    cooldown,
+                )
+            elif (
+                status_code in KEY_EXHAUSTED_STATUS_CODES and key not in self._exhausted
+            ):
+                self._exhausted.add(key)
+                Log.error(
+                    f"API key {KeyPool.redact(key)} rejected (HTTP {status_code}), setting aside"
+                )
+            self._lock.notify_all()
+
+    def get_summary(self) -> list[str]:
+        with self._lock:
+            return [
+                f"API key {KeyPool.redact(key)}: {self._requests[key]} request{'s' if self._requests[key] != 1 else ''}, "
+                f"{self._throttled[key]} rate limited"
+                f"{', exhausted' if key in self._exhausted else ''}"
+                for key in self._keys
+            ]
@@ -0,0 +1,97 @@
+import json
+import math
+import os
+import statistics
+import threading
+
+from src.config import (
+    LATENCY_HISTORY_FILENAME,
+    LATENCY_HISTORY_SIZE,
+    PROVIDER_MIN_RELIABILITY,
+)
+from src.log import Log
+
+
+class LatencyHistory:
+    """
+    LatencyHistory keeps the most recent request durations per model (and
+    per upstream provider of each model) and persists them in the log
+    directory so that they survive restarts.
+    """
+
+    def __init__(self, log_directory: str):
+        self._path = os.path.join(log_directory, LATENCY_HISTORY_FILENAME)
+        self._lock = threading.Lock()
+        self._models: dict[str, list[float]] = {}
+        self._providers: dict[str, dict[str, dict]] = {}
+
+        if os.path.exists(self._path):
+            try:
+                with open(self._path, "r") as file:
+                    data = json.load(file)
+                self._models = data.get("models", {})
+                self._providers = data.get("providers", {})
+            except Exception as e:
+                Log.error(f"Failed to load latency history: {e}")
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            samples = self._models.setdefault(model, [])
+            samples.append(seconds)
+            del samples[:-LATENCY_HISTORY_SIZE]
+
+    def record_provider(self, model: str, provider: str, seconds: float, success: bool):
+        with self._lock:
+            stats = self._providers.setdefault(model, {}).setdefault(
+                provider, {"samples": [], "outcomes": []}
+            )
+            stats["outcomes"].append(success)
+            del stats["outcomes"][:-LATENCY_HISTORY_SIZE]
+            if success:
+                stats["samples"].append(seconds)
+                del stats["samples"][:-LATENCY_HISTORY_SIZE]
+
+    def provider_order(self, model: str) -> list[str]:
+        """
+        Returns the known providers of the model, reliable ones (success rate
+        of at least PROVIDER_MIN_RELIABILITY) first, each group sorted by
+        median latency
+        """
+        with self._lock:
+            providers = {
+                provider: (
+                    sum(stats["outcomes"]) / len(stats["outcomes"])
+                    < PROVIDER_MIN_RELIABILITY,
+                    statistics.median(stats["samples"])
+                    if stats["samples"]
+                    else math.inf,
+                )
+                for provider, stats in self._providers.get(model, {}).items()
+                if stats["outcomes"]
+            }
+        return sorted(providers, key=lambda provider: providers[provider])
+
+    def samples(self, model: str) -> list[float]:
+        with self._lock:
+            return list(self._models.get(model, []))
+
+    def expected(self, model: str) -> float | None:
+        """Returns the median latency of the model or None if there is no history"""
+        samples = self.samples(model)
+        if not samples:
+            return None
+        return statistics.median(samples)
+
+    def percentile(self, model: str, percentile: float) -> float | None:
+        """Returns the nearest-rank percentile of the model's latency or None if there is no history"""
+        samples = sorted(self.samples(model))
+        if not samples:
+            return None
+        rank = math.ceil(percentile / 100 * len(samples))
+        return samples[max(rank, 1) - 1]
+
+    def save(self):
+        with self._lock:
+            data = {"models": self._models, "providers": self._providers}
+            with open(self._path, "w") as file:
+                json.dump(data, file, indent=4)
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.config import METRICS_LATENCY_BUCKETS
+from src.log import Log
+
+
+class Metrics:
+    """
+    Metrics collects live counters of the fetch daemon and exposes them in
+    the Prometheus text format, either on a local HTTP endpoint (/metrics) or
+    in a textfile that is rewritten periodically (for the node exporter's
+    textfile collector). Without configuration, it only counts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        self._next_tick: datetime | None = None
+        self._latency_buckets: dict[str, list[int]] = {}
+        self._latency_sum: dict[str, float] = {}
+        self._latency_count: dict[str, int] = {}
+        self._queries: dict[tuple[str, str], int] = {}
+        self._retries: dict[str, int] = {}
+        self._rate_limited: dict[str, int] = {}
+        self._timeouts: dict[str, int] = {}
+        self._bytes: dict[str, int] = {}
+
+    def serve(self, host: str, port: int):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        Log.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    def write_periodically(self, path: str, interval: float):
+        def loop():
+            while True:
+                try:
+                    with open(f"{path}.tmp", "w") as file:
+                        file.write(self.render())
+                    os.replace(f"{path}.tmp", path)
+                except Exception as e:
+                    Log.error(f"Failed to write metrics textfile: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, daemon=True).start()
+        Log.info(f"Writing metrics to '{path}' every {interval}s")
+
+    def set_queued(self, count: int):
+        with self._lock:
+            self._queued = count
+
+    def set_next_tick(self, next_tick: datetime | None):
+        with self._lock:
+            self._next_tick = next_tick
+
+    def query_started(self):
+        with self._lock:
+            self._queued = max(0, self._queued - 1)
+            self._in_flight += 1
+
+    def query_finished(self, model: str, status: str):
+        with self._lock:
+            self._in_flight -= 1
+            self._queries[(model, status)] = self._queries.get((model, status), 0) + 1
+
+    def query_dropped(self):
+        with self._lock:
+            self._queued = max(0, self._queued - 1)
+
+    def observe_request(
+        self,
+        model: str,
+        seconds: float,
+        received_bytes: int,
+        rate_limited: bool,
+        timed_out: bool,
+    ):
+        with self._lock:
+            buckets = self._latency_buckets.setdefault(
+                model, [0] * len(METRICS_LATENCY_BUCKETS)
+            )
+            for i, bound in enumerate(METRICS_LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self._latency_sum[model] = self._latency_sum.get(model, 0) + seconds
+            self._latency_count[model] = self._latency_count.get(model, 0) + 1
+            self._bytes[model] = self._bytes.get(model, 0) + received_bytes
+            if rate_limited:
+                self._rate_limited[model] = self._rate_limited.get(model, 0) + 1
+            if timed_out:
+                self._timeouts[model] = self._timeouts.get(model, 0) + 1
+
+    def observe_retry(self, model: str):
+        with self._lock:
+            self._retries[model] = self._retries.get(model, 0) + 1
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP automp_fetch_queries_in_flight Queries currently running",
+                "# TYPE automp_fetch_queries_in_flight gauge",
+                f"automp_fetch_queries_in_flight {self._in_flight}",
+                "# HELP automp_fetch_queries_queued Queries of the current iteration not started yet",
+                "# TYPE automp_fetch_queries_queued gauge",
+                f"automp_fetch_queries_queued {self._queued}",
+            ]
+            if self._next_tick is not None:
+                lines += [
+                    "# HELP automp_fetch_next_tick_seconds Seconds until the next iteration",
+                    "# TYPE automp_fetch_next_tick_seconds gauge",
+                    f"automp_fetch_next_tick_seconds {max(0.0, (self._next_tick - datetime.now()).total_seconds())}",
+                ]
+
+            lines += [
+                "# HELP automp_fetch_request_seconds Duration of OpenRouter requests",
+                "# TYPE automp_fetch_request_seconds histogram",
+            ]
+            for model, buckets in sorted(self._latency_buckets.items()):
+                for bound, count in zip(METRICS_LATENCY_BUCKETS, buckets):
+                    lines.append(
+                        f'automp_fetch_request_seconds_bucket{{model="{model}",le="{bound}"}} {count}'
+                    )
+                lines += [
+                    f'automp_fetch_request_seconds_bucket{{model="{model}",le="+Inf"}} {self._latency_count[model]}',
+                    f'automp_fetch_request_seconds_sum{{model="{model}"}} {self._latency_sum[model]}',
+                    f'automp_fetch_request_seconds_count{{model="{model}"}} {self._latency_count[model]}',
+                ]
+
+            lines += [
+                "# HELP automp_fetch_queries_total Finished queries by status",
+                "# TYPE automp_fetch_queries_total counter",
+            ]
+            for (model, status), count in sorted(self._queries.items()):
+                lines.append(
+                    f'automp_fetch_queries_total{{model="{model}",status="{status}"}} {count}'
+                )
+
+            for name, help_text, values in [
+                ("retries", "Retried requests", self._retries),
+                ("rate_limited", "Requests answered with HTTP 429", self._rate_limited),
+                ("timeouts", "Requests that timed out", self._timeouts),
+                ("received_bytes", "Bytes of response bodies", self._bytes),
+            ]:
+                lines += [
+                    f"# HELP automp_fetch_{name}_total {help_text}",
+                    f"# TYPE automp_fetch_{name}_total counter",
+                ]
+                for model, count in sorted(values.items()):
+                    lines.append(
+                        f'automp_fetch_{name}_total{{model="{model}"}} {count}'
+                    )
+
+        return "\n".join(lines) + "\n"
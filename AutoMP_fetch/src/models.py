@@ -1,20 +1,51 @@
 import json
 import os
+import re
 import sys
+import tempfile
 import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
+from typing import IO, Callable
 
 import requests
-from src.config import OPENROUTER_URL, QUERY_TIMEOUT_SECONDS, TEST_QUERY
+import src.jsonio as jsonio
+from src.config import (
+    CODE_FENCE_PATTERN,
+    OPENROUTER_URL,
+    RESPONSE_CHUNK_BYTES,
+    RESPONSE_SPOOL_BYTES,
+    TEST_QUERY,
+    TIMEOUT_MIN_SAMPLES,
+)
 from src.job import Job
+from src.keypool import KeyPool
+from src.latency import LatencyHistory
 from src.log import Log
+from src.metrics import Metrics
+from src.scheduler import get_max_workers, submit_bounded
+from src.tracing import Trace
+
+
+@dataclass
+class QueryResult:
+    success: bool = False
+    message: str = ""
+    attempts: int = 0
+    valid: bool = False  # the response contains a fenced code block
+    skipped: bool = False  # the query was not (completely) run, nothing was written
 
 
 class Models:
-    def __init__(self, job: Job):
+    def __init__(
+        self, job: Job, history: LatencyHistory, keys: KeyPool, metrics: Metrics
+    ):
         self._job = job
+        self._history = history
+        self._keys = keys
+        self._metrics = metrics
 
     def perform_check(self):
         Log.info("Starting test queries")
@@ -27,23 +58,21 @@ class Models:
             )
 
             if self._job.get_threading():
-                futures = []
-                with ThreadPoolExecutor() as executor:
-                    for model in self._job.get_models():
-                        futures.append(
-                            executor.submit(
-                                self.__query,
-                                model,
-                                TEST_QUERY,
-                                "",
-                                "",
-                                False,
-                                False,
-                            )
-                        )
-
-                    for future in as_completed(futures):
-                        if not future.result():
+                with ThreadPoolExecutor(max_workers=get_max_workers()) as executor:
+                    for model, future in submit_bounded(
+                        self._job.get_models(),
+                        lambda model: executor.submit(
+                            self.__query,
+                            model,
+                            TEST_QUERY,
+                            "",
+                            "",
+                            False,
+                            False,
+                            True,
+                        ),
+                    ):
+                        if not future.result().success:
                             errors = True
                             Log.error(f"Test query error for model '{model}'")
                         progress.update(progress_bar_task, advance=1)
@@ -56,7 +85,8 @@ class Models:
                         "test-query",
                         True,
                         False,
-                    ):
+                        True,
+                    ).success:
                         errors = True
                         Log.error(f"Test query error for model '{model}'")
                     progress.update(progress_bar_task, advance=1)
@@ -75,12 +105,19 @@ class Models:
         task_name: str,
         prompt: str,
         code: str | None,
-    ):
+        sample: int | None = None,
+        cancelled: Callable[[], bool] | None = None,
+    ) -> QueryResult:
+        """
+        Runs a query and writes its output and logs. The sample number is only
+        set if more than one sample per task and model is requested. Retries
+        stop early once cancelled() returns True.
+        """
         timestamp_str = timestamp.strftime("%Y%m%d%H%M%S")
 
         path = os.path.join(
             self._job.get_output_directory(),
-            f"{timestamp_str}__{task_name}__{model}".replace("/", "_"),
+            Models.get_filename(timestamp_str, task_name, model, sample),
         )
         if os.path.exists(path):
             Log.error(f"Output file '{path}' already exists")
@@ -88,11 +125,11 @@ class Models:
                 self._job.get_log_directory(),
                 timestamp_str,
                 task_name,
-                model,
+                Models.get_sample_name(model, sample),
                 False,
                 f"output file '{path}' already exists",
             )
-            return
+            return QueryResult(message=f"output file '{path}' already exists")
 
         query = ""
         if self._job.has_input_directive():
@@ -101,19 +138,25 @@ class Models:
         if code is not None:
             query += "\n\n" + code
 
-        success, message = self.__query(
-            model, query, timestamp_str, task_name, True, True
+        result = self.__query(
+            model, query, timestamp_str, task_name, True, True, False, sample, cancelled
         )
+        if result.skipped:
+            Log.debug("Cancelled query for model '%s': %s", model, result.message)
+            return result
 
         Log.logfile_write_fetch(
             self._job.get_log_directory(),
             timestamp_str,
             task_name,
-            model,
-            success,
-            message,
+            Models.get_sample_name(model, sample),
+            result.success,
+            result.message,
         )
 
+        return result
+
+    @Trace.traced("Models.__query")
     def __query(
         self,
         model: str,
@@ -122,162 +165,312 @@ class Models:
         task_name: str,
         write_log: bool = True,
         write_output: bool = True,
-    ):
-        """Returns True if the request was successful, False otherwise; also returns a string during which phase the error occurred"""
-        Log.debug(f"Starting query for model '{model}'")
-
-        filename_log = os.path.join(
-            self._job.get_log_directory(),
-            f"{timestamp_str}__{task_name}__{model.replace('/', '_')}.json",
-        )
-        filename_output = os.path.join(
-            self._job.get_output_directory(),
-            f"{timestamp_str}__{task_name}__{model.replace('/', '_')}",
-        )
-
+        test_query: bool = False,
+        sample: int | None = None,
+        cancelled: Callable[[], bool] | None = None,
+    ) -> QueryResult:
+        """Returns a QueryResult; on failure, its message tells during which phase the error occurred"""
+        Log.debug("Starting query for model '%s'", model)
+
+        # test queries are much shorter than real ones and must not shape the history
+        timeout = self.get_timeout(model)
+        record_latency = not test_query
+
+        filename = Models.get_filename(timestamp_str, task_name, model, sample)
+        filename_log = os.path.join(self._job.get_log_directory(), f"{filename}.json")
+        filename_output = os.path.join(self._job.get_output_directory(), filename)
+
+        attempts = 0
         try:
-            request_success, message, seconds = self.__request(model, content)
+            request_success, message, seconds, key = self.__request(
+                model, content, timeout, record_latency
+            )
+            attempts = 1
 
-            if not request_success and self._job.get_max_attempts() > 1:
-                attempts = 1
-                while not request_success and attempts < self._job.get_max_attempts():
-                    Log.debug(
-                        f"Retrying query for model '{model}' (attempt {attempts}/{self._job.get_max_attempts()})"
+            while not request_success and attempts < self._job.get_max_attempts():
+                if cancelled is not None and cancelled():
+                    return QueryResult(
+                        message="target reached", attempts=attempts, skipped=True
                     )
-                    request_success, message, seconds = self.__request(model, content)
-                    attempts += 1
+                Log.debug(
+                    "Retrying query for model '%s' (attempt %d/%d)",
+                    model,
+                    attempts,
+                    self._job.get_max_attempts(),
+                )
+                self._metrics.observe_retry(model)
+                request_success, message, seconds, key = self.__request(
+                    model, content, timeout, record_latency
+                )
+                attempts += 1
 
             if not request_success:
-                Log.debug(f"Failed query for model '{model}' during request")
+                Log.debug("Failed query for model '%s' during request", model)
                 if write_log:
                     self.__write_log(
                         filename_log,
                         request_success=request_success,
                         request_seconds=seconds,
+                        request_timeout=timeout,
+                        api_key=key,
                         request_error=message,
                     )
                 if write_output:
                     self.__write_output(
                         filename_output, "[AutoMP_fetch] An error occurred"
                     )
-                return False, "error during request"
+                return QueryResult(message="error during request", attempts=attempts)
 
+            # the body is parsed exactly once, straight from the (possibly
+            # spooled to disk) response stream
             parsing_error = None
+            parsing_start = time.time()
+            with message as body, Trace.span("Models.__query.parse"):
+                try:
+                    response_data = jsonio.load(body)
+                except Exception:
+                    response_data = None
+                    body.seek(0)
+                    message = body.read().decode(errors="replace")
             try:
-                text_response = json.loads(message)["choices"][0]["message"]["content"]
+                text_response = response_data["choices"][0]["message"]["content"]
             except Exception:
                 text_response = None
                 parsing_error = (
                     "cannot find 'choices[0].message.content' in OpenRouter response"
                 )
+            parsing_seconds = time.time() - parsing_start
+
+            if (
+                record_latency
+                and isinstance(response_data, dict)
+                and isinstance(response_data.get("provider"), str)
+            ):
+                self._history.record_provider(
+                    model,
+                    response_data["provider"],
+                    seconds,
+                    text_response is not None,
+                )
 
             if text_response is None:
-                Log.debug(f"Failed query for model '{model}' during parsing")
+                Log.debug("Failed query for model '%s' during parsing", model)
                 if write_log:
                     self.__write_log(
                         filename_log,
                         request_success=request_success,
                         request_seconds=seconds,
+                        request_timeout=timeout,
+                        api_key=key,
                         parsing_success=False,
+                        parsing_seconds=parsing_seconds,
                         parsing_error=parsing_error,
-                        openrouter=message,
+                        openrouter=message if response_data is None else response_data,
                     )
                 if write_output:
                     self.__write_output(
                         filename_output, "[AutoMP_fetch] An error occurred"
                     )
-                return False, "error during parsing"
+                return QueryResult(message="error during parsing", attempts=attempts)
+
+            Log.debug("Completed query for model '%s'", model)
 
-            Log.debug(f"Completed query for model '{model}'")
+            valid = (
+                len(re.findall(CODE_FENCE_PATTERN, text_response, re.MULTILINE)) >= 2
+            )  # an opening and a closing fence
+
+            write_seconds = None
+            if write_output:
+                write_start = time.time()
+                self.__write_output(filename_output, text_response)
+                write_seconds = time.time() - write_start
 
             if write_log:
-                try:
-                    openrouter_content = json.loads(message)
-                    openrouter_content["choices"][0]["message"]["content"] = (
-                        "[AutoMP_fetch] See corresponding output file"
-                    )
-                except Exception:
-                    openrouter_content = None
+                # the content is in the output file, drop it instead of copying
+                response_data["choices"][0]["message"]["content"] = (
+                    "[AutoMP_fetch] See corresponding output file"
+                )
                 self.__write_log(
                     filename_log,
                     request_success=request_success,
                     request_seconds=seconds,
+                    request_timeout=timeout,
+                    api_key=key,
                     parsing_success=True,
+                    parsing_seconds=parsing_seconds,
                     parsing_error=parsing_error,
-                    openrouter=openrouter_content,
+                    write_seconds=write_seconds,
+                    openrouter=response_data,
                 )
 
-            if write_output:
-                self.__write_output(filename_output, text_response)
-
-            return True, ""
+            return QueryResult(success=True, attempts=attempts, valid=valid)
 
         except Exception:
-            return False, str(traceback.format_exc())
+            return QueryResult(message=str(traceback.format_exc()), attempts=attempts)
+
+    @staticmethod
+    def get_sample_name(model: str, sample: int | None) -> str:
+        """
+        Appends the sample number to the model name. The ':' separator keeps
+        the model name intact for AutoMP_test, which cuts the name at ':'.
+        """
+        if sample is None:
+            return model
+        return f"{model}:sample{sample}"
+
+    @staticmethod
+    def get_filename(
+        timestamp_str: str, task_name: str, model: str, sample: int | None = None
+    ) -> str:
+        return f"{timestamp_str}__{task_name}__{Models.get_sample_name(model, sample).replace('/', '_')}"
 
+    @Trace.traced("Models.__write_output")
     def __write_output(self, output_filename: str, content: str):
         with open(output_filename, "w") as file:
             file.write(content)
 
+    @Trace.traced("Models.__write_log")
     def __write_log(
         self,
         log_filename: str,
         request_success: bool = None,
         request_seconds: float = None,
+        request_timeout: float = None,
         request_error: str = None,
+        api_key: str = None,
         openrouter: dict = None,
         parsing_success: bool = None,
+        parsing_seconds: float = None,
         parsing_error: str = None,
+        write_seconds: float = None,
     ):
-        with open(log_filename, "w") as file:
-            json.dump(
+        with open(log_filename, "wb") as file:
+            jsonio.dump(
                 {
                     "request_success": request_success,
                     "request_seconds": request_seconds,
+                    "request_timeout": request_timeout,
                     "request_error": request_error,
+                    "api_key": api_key,
                     "openrouter": openrouter,
                     "parsing_success": parsing_success,
+                    "parsing_seconds": parsing_seconds,
                     "parsing_error": parsing_error,
+                    "write_seconds": write_seconds,
                 },
                 file,
-                indent=4,
             )
 
-    def __request(self, model: str, content: str) -> tuple[bool, str, float]:
+    def get_timeout(self, model: str) -> float:
         """
-        Returns a tuple of a bool (whether the request was successful), a
-        string (either the error message or the response content) and a float
-        (the time the request took in seconds).
+        Returns the request timeout for the model: a configured override, or
+        the latency percentile of the model's history times the margin,
+        clamped between floor and ceiling. Falls back to the default timeout
+        while there are too few samples.
+        """
+        overrides = self._job.get_timeout_overrides()
+        if model in overrides:
+            return overrides[model]
+
+        if (
+            not self._job.get_timeout_adaptive()
+            or len(self._history.samples(model)) < TIMEOUT_MIN_SAMPLES
+        ):
+            return self._job.get_timeout_default()
+
+        percentile = self._history.percentile(model, self._job.get_timeout_percentile())
+        return min(
+            max(
+                percentile * self._job.get_timeout_margin(),
+                self._job.get_timeout_floor(),
+            ),
+            self._job.get_timeout_ceiling(),
+        )
+
+    @Trace.traced("Models.__request")
+    def __request(
+        self, model: str, content: str, timeout: float, record_latency: bool = True
+    ) -> tuple[bool, str | IO[bytes], float, str | None]:
+        """
+        Returns a tuple of a bool (whether the request was successful), either
+        the error message or a binary file with the response body, a float
+        (the time the request took in seconds) and the redacted API key that
+        was used. A rate limited response (HTTP 429) counts as unsuccessful
+        so that it is retried, usually with another key.
+
+        The body is received in chunks into a file that stays in memory up to
+        RESPONSE_SPOOL_BYTES and moves to disk beyond that, so the raw body is
+        never held as both bytes and a decoded string. It is still read as a
+        whole once to be parsed.
+
+        Completed requests and timeouts are recorded in the latency history;
+        a timeout is recorded with its full duration so that the timeout of
+        a model that keeps timing out grows towards the ceiling.
         """
 
         success = None
         message = None
         seconds = None
 
+        body = {
+            "model": model,
+            "messages": [{"role": "user", "content": content}],
+        }
+        if self._job.get_provider_routing():
+            order = self._history.provider_order(model)
+            if order:
+                body["provider"] = {"order": order, "allow_fallbacks": True}
+
+        key = self._keys.acquire()
+        if key is None:
+            return False, "all API keys are exhausted", 0.0, None
+
         start_time = time.time()
+        received_bytes = 0
 
         try:
-            response = requests.post(
+            with requests.post(
                 url=OPENROUTER_URL,
                 headers={
-                    "Authorization": f"Bearer {self._job.get_openrouter_api_key()}",
+                    "Authorization": f"Bearer {key}",
                 },
-                data=json.dumps(
-                    {
-                        "model": model,
-                        "messages": [{"role": "user", "content": content}],
-                    }
-                ),
-                timeout=QUERY_TIMEOUT_SECONDS,
-            )
+                data=json.dumps(body),
+                timeout=timeout,
+                stream=True,
+            ) as response:
+                message = tempfile.SpooledTemporaryFile(max_size=RESPONSE_SPOOL_BYTES)
+                for chunk in response.iter_content(RESPONSE_CHUNK_BYTES):
+                    message.write(chunk)
+                    received_bytes += len(chunk)
+                message.seek(0)
             end_time = time.time()
-            success = True
-            message = response.text
+            self._keys.release(
+                key, response.status_code, response.headers.get("Retry-After")
+            )
+            success = response.status_code != 429
+            if not success:
+                with message as body:
+                    message = body.read().decode(errors="replace")
+            timed_out = False
         except Exception as e:
             end_time = time.time()
+            self._keys.release(key, None, None)
+            response = None
             success = False
             message = str(e)
+            timed_out = isinstance(e, requests.Timeout)
 
         seconds = end_time - start_time
 
-        return success, message, seconds
+        self._metrics.observe_request(
+            model,
+            seconds,
+            received_bytes,
+            response is not None and response.status_code == 429,
+            timed_out,
+        )
+
+        if record_latency and (success or timed_out):
+            self._history.record(model, seconds)
+
+        return success, message, seconds, KeyPool.redact(key)
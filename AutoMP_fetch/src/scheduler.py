@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from itertools import zip_longest
+from typing import Any, Callable, Iterable
+
+from src.config import SUBMISSION_QUEUE_FACTOR
+from src.latency import LatencyHistory
+
+
+def order_work(
+    tasks: list[dict],
+    models: list[str],
+    samples: int,
+    policy: str,
+    history: LatencyHistory,
+):
+    """
+    Yields (task, model, sample) items in the order in which they should be
+    submitted. The sample is None if only one sample per task and model is
+    requested; otherwise all samples of a (task, model) pair are yielded one
+    after the other, so that every pair (and task) is completed in order.
+
+    Policies:
+        task-order: every model for the first task, then every model for the
+            second task, and so on
+        longest-first: task order, but within each task the models with the
+            highest expected latency first, so that slow models do not end up
+            at the tail of a task; models without history are treated as the
+            slowest
+        round-robin: task order, but consecutive queries alternate between
+            providers (the part of the model name before '/')
+    """
+    for task, model in _order_pairs(tasks, models, policy, history):
+        for sample in range(1, samples + 1):
+            yield task, model, sample if samples > 1 else None
+
+
+def _order_pairs(
+    tasks: list[dict], models: list[str], policy: str, history: LatencyHistory
+):
+    if policy == "longest-first":
+        ordered = sorted(
+            models,
+            key=lambda m: (
+                history.expected(m) is not None,
+                -(history.expected(m) or 0),
+            ),
+        )
+        for task in tasks:
+            for model in ordered:
+                yield task, model
+    elif policy == "round-robin":
+        ordered = _interleave_by_provider(models)
+        for task in tasks:
+            for model in ordered:
+                yield task, model
+    else:
+        for task in tasks:
+            for model in models:
+                yield task, model
+
+
+def _interleave_by_provider(models: list[str]) -> list[str]:
+    providers: dict[str, list[str]] = {}
+    for model in models:
+        providers.setdefault(model.split("/")[0], []).append(model)
+    return [
+        model
+        for group in zip_longest(*providers.values())
+        for model in group
+        if model is not None
+    ]
+
+
+def get_max_workers() -> int:
+    # same default as ThreadPoolExecutor
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def submit_bounded(
+    items: Iterable,
+    submit: Callable[[Any], Future],
+    max_pending: int | None = None,
+):
+    """
+    Pulls items lazily and submits them, keeping at most max_pending futures
+    (by default SUBMISSION_QUEUE_FACTOR per worker) alive at a time. Yields
+    (item, future) pairs as the futures complete, so memory depends on the
+    concurrency instead of the number of items.
+    """
+    if max_pending is None:
+        max_pending = get_max_workers() * SUBMISSION_QUEUE_FACTOR
+    items = iter(items)
+    pending: dict[Future, Any] = {}
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_pending:
+            try:
+                item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            pending[submit(item)] = item
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
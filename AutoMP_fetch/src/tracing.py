@@ -0,0 +1,107 @@
+import atexit
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Trace:
+    """
+    Trace records spans in the Chrome trace event format, viewable in
+    chrome://tracing or Perfetto. Spans are only recorded after enable().
+    """
+
+    path: str | None = None
+    _events: list[dict] = []
+    _lock = threading.Lock()
+
+    @staticmethod
+    def enable(path: str):
+        Trace.path = path
+        atexit.register(Trace.save)
+
+    @staticmethod
+    @contextmanager
+    def span(name: str, **args):
+        if Trace.path is None:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            with Trace._lock:
+                Trace._events.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": start / 1000,
+                        "dur": (end - start) / 1000,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": args,
+                    }
+                )
+
+    @staticmethod
+    def traced(name: str):
+        """Decorator that records every call of the function as a span"""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if Trace.path is None:
+                    return function(*args, **kwargs)
+                with Trace.span(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @staticmethod
+    def save():
+        if Trace.path is None:
+            return
+        with Trace._lock:
+            with open(Trace.path, "w") as file:
+                json.dump({"traceEvents": Trace._events, "displayTimeUnit": "ms"}, file)
+
+
+class Profiler:
+    """
+    Profiler runs cProfile in the main thread and writes a per-function
+    summary (sorted by cumulative time) to the given path and the raw
+    statistics to '<path>.prof'. Only one cProfile can be active at a time
+    (Python 3.12+), so work in other threads and in worker processes shows up
+    as the time the main thread spends waiting for it.
+    """
+
+    path: str | None = None
+    _profile: cProfile.Profile | None = None
+
+    @staticmethod
+    def enable(path: str):
+        Profiler.path = path
+        Profiler._profile = cProfile.Profile()
+        Profiler._profile.enable()
+        atexit.register(Profiler.save)
+
+    @staticmethod
+    def save():
+        if Profiler.path is None or Profiler._profile is None:
+            return
+        Profiler._profile.disable()
+
+        summary = io.StringIO()
+        stats = pstats.Stats(Profiler._profile, stream=summary)
+        stats.dump_stats(f"{Profiler.path}.prof")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats()
+        with open(Profiler.path, "w") as file:
+            file.write(summary.getvalue())
@@ -6,8 +6,9 @@ from typing import Any
 import src.error as e
 from croniter import croniter
 from ruamel.yaml import YAML
+from src.config import SCHEDULING_POLICIES
 from src.cron import validate_cron
-from src.log import Log
+from src.log import FSYNC_POLICIES, LEVELS, LOG_FORMATS, ROTATION_INTERVALS, Log
 
 
 def _validate(
@@ -62,6 +63,15 @@ class Validator:
         errors.extend(Validator.__validate_notify_on_success(data))
         errors.extend(Validator.__validate_threading(data))
         errors.extend(Validator.__validate_max_attempts(data))
+        errors.extend(Validator.__validate_scheduling(data))
+        errors.extend(Validator.__validate_timeout(data))
+        errors.extend(Validator.__validate_provider_routing(data))
+        errors.extend(Validator.__validate_samples(data))
+        errors.extend(Validator.__validate_shutdown_deadline(data))
+        errors.extend(Validator.__validate_target_successes(data))
+        errors.extend(Validator.__validate_metrics(data))
+        errors.extend(Validator.__validate_log_options(data))
+        errors.extend(Validator.__validate_log_rotation(data))
 
         return errors, data
 
@@ -315,7 +325,20 @@ class Validator:
 
     @staticmethod
     def __validate_openrouter_api_key(data) -> list[str]:
-        return _validate(data, "openrouter-api-key", True, str)
+        errors = _validate(data, "openrouter-api-key", True, (str, list))
+        if errors:
+            return errors
+
+        if isinstance(data["openrouter-api-key"], list):
+            if len(data["openrouter-api-key"]) == 0:
+                return [e.value_error("openrouter-api-key", "[]", "list is empty")]
+            for key in data["openrouter-api-key"]:
+                if not isinstance(key, str):
+                    errors.append(
+                        e.type_error("openrouter-api-key", "string", type(key).__name__)
+                    )
+
+        return errors
 
     @staticmethod
     def __validate_log_directory(data) -> list[str]:
@@ -365,3 +388,287 @@ class Validator:
     @staticmethod
     def __validate_max_attempts(data) -> list[str]:
         return _validate(data, "max-attempts", False, int)
+
+    @staticmethod
+    def __validate_scheduling(data) -> list[str]:
+        errors = _validate(data, "scheduling", False, str)
+        if errors:
+            return errors
+
+        if "scheduling" in data and data["scheduling"] not in SCHEDULING_POLICIES:
+            return [
+                e.value_error(
+                    "scheduling",
+                    data["scheduling"],
+                    f"must be one of {', '.join(SCHEDULING_POLICIES)}",
+                )
+            ]
+
+        return []
+
+    @staticmethod
+    def __validate_timeout(data) -> list[str]:
+        errors = _validate(data, "timeout", False, dict)
+        if errors:
+            return errors
+
+        if "timeout" not in data:
+            return []
+
+        timeout = data["timeout"]
+        if "adaptive" in timeout and not isinstance(timeout["adaptive"], bool):
+            errors.append(
+                e.type_error(
+                    "timeout.adaptive", "bool", type(timeout["adaptive"]).__name__
+                )
+            )
+        for key in ["default", "percentile", "margin", "floor", "ceiling"]:
+            if key not in timeout:
+                continue
+            if not isinstance(timeout[key], (int, float)):
+                errors.append(
+                    e.type_error(
+                        f"timeout.{key}", "int, float", type(timeout[key]).__name__
+                    )
+                )
+            elif timeout[key] <= 0:
+                errors.append(
+                    e.value_error(f"timeout.{key}", timeout[key], "must be > 0")
+                )
+        if errors:
+            return errors
+
+        if "percentile" in timeout and timeout["percentile"] > 100:
+            errors.append(
+                e.value_error(
+                    "timeout.percentile", timeout["percentile"], "must be <= 100"
+                )
+            )
+        if (
+            "floor" in timeout
+            and "ceiling" in timeout
+            and timeout["floor"] > timeout["ceiling"]
+        ):
+            errors.append(
+                e.constraint_error(
+                    "timeout", "floor <= ceiling", "floor is greater than ceiling"
+                )
+            )
+
+        if "overrides" in timeout:
+            if not isinstance(timeout["overrides"], dict):
+                errors.append(
+                    e.type_error(
+                        "timeout.overrides", "dict", type(timeout["overrides"]).__name__
+                    )
+                )
+            else:
+                for model, seconds in timeout["overrides"].items():
+                    if not isinstance(seconds, (int, float)):
+                        errors.append(
+                            e.type_error(
+                                f"timeout.overrides.{model}",
+                                "int, float",
+                                type(seconds).__name__,
+                            )
+                        )
+                    elif seconds <= 0:
+                        errors.append(
+                            e.value_error(
+                                f"timeout.overrides.{model}", seconds, "must be > 0"
+                            )
+                        )
+
+        return errors
+
+    @staticmethod
+    def __validate_provider_routing(data) -> list[str]:
+        return _validate(data, "provider-routing", False, bool)
+
+    @staticmethod
+    def __validate_samples(data) -> list[str]:
+        errors = _validate(data, "samples", False, int)
+        if errors:
+            return errors
+
+        if "samples" in data and data["samples"] < 1:
+            return [e.value_error("samples", data["samples"], "must be >= 1")]
+
+        return []
+
+    @staticmethod
+    def __validate_shutdown_deadline(data) -> list[str]:
+        errors = _validate(data, "shutdown-deadline", False, (int, float))
+        if errors:
+            return errors
+
+        if "shutdown-deadline" in data and data["shutdown-deadline"] < 0:
+            return [
+                e.value_error(
+                    "shutdown-deadline", data["shutdown-deadline"], "must be >= 0"
+                )
+            ]
+
+        return []
+
+    @staticmethod
+    def __validate_target_successes(data) -> list[str]:
+        errors = _validate(data, "target-successes", False, int)
+        if errors:
+            return errors
+
+        if "target-successes" in data:
+            if data["target-successes"] < 1:
+                return [
+                    e.value_error(
+                        "target-successes", data["target-successes"], "must be >= 1"
+                    )
+                ]
+            if data["target-successes"] > data.get("samples", 1):
+                return [
+                    e.constraint_error(
+                        "target-successes",
+                        "target-successes <= samples",
+                        "target can never be reached with the configured samples",
+                    )
+                ]
+
+        return []
+
+    @staticmethod
+    def __validate_metrics(data) -> list[str]:
+        errors = _validate(data, "metrics", False, dict)
+        if errors:
+            return errors
+
+        if "metrics" not in data:
+            return []
+
+        metrics = data["metrics"]
+        if "port" not in metrics and "textfile" not in metrics:
+            return [
+                e.constraint_error(
+                    "metrics",
+                    "'port' or 'textfile'",
+                    "found neither 'port' nor 'textfile' item",
+                )
+            ]
+        if "port" in metrics:
+            if not isinstance(metrics["port"], int):
+                errors.append(
+                    e.type_error("metrics.port", "int", type(metrics["port"]).__name__)
+                )
+            elif not 0 < metrics["port"] < 65536:
+                errors.append(
+                    e.value_error("metrics.port", metrics["port"], "not a valid port")
+                )
+        if "host" in metrics and not isinstance(metrics["host"], str):
+            errors.append(
+                e.type_error("metrics.host", "str", type(metrics["host"]).__name__)
+            )
+        if "textfile" in metrics:
+            if not isinstance(metrics["textfile"], str):
+                errors.append(
+                    e.type_error(
+                        "metrics.textfile", "str", type(metrics["textfile"]).__name__
+                    )
+                )
+            else:
+                if os.path.isabs(metrics["textfile"]):
+                    path = metrics["textfile"]
+                else:
+                    path = os.path.abspath(
+                        os.path.join(Validator.__path, metrics["textfile"])
+                    )
+                if not os.path.isdir(os.path.dirname(path)):
+                    errors.append(
+                        e.value_error(
+                            "metrics.textfile", path, "parent directory does not exist"
+                        )
+                    )
+        if "interval" in metrics:
+            if not isinstance(metrics["interval"], (int, float)):
+                errors.append(
+                    e.type_error(
+                        "metrics.interval",
+                        "int, float",
+                        type(metrics["interval"]).__name__,
+                    )
+                )
+            elif metrics["interval"] <= 0:
+                errors.append(
+                    e.value_error(
+                        "metrics.interval", metrics["interval"], "must be > 0"
+                    )
+                )
+
+        return errors
+
+    @staticmethod
+    def __validate_log_options(data) -> list[str]:
+        errors = []
+        for key, allowed in [
+            ("log-format", LOG_FORMATS),
+            ("log-fsync", FSYNC_POLICIES),
+            ("log-level", list(LEVELS.keys())),
+        ]:
+            key_errors = _validate(data, key, False, str)
+            if key_errors:
+                errors.extend(key_errors)
+            elif key in data and data[key] not in allowed:
+                errors.append(
+                    e.value_error(
+                        key, data[key], f"must be one of {', '.join(allowed)}"
+                    )
+                )
+        return errors
+
+    @staticmethod
+    def __validate_log_rotation(data) -> list[str]:
+        errors = _validate(data, "log-rotation", False, dict)
+        if errors or "log-rotation" not in data:
+            return errors
+
+        rotation = data["log-rotation"]
+        if "max-bytes" not in rotation and "interval" not in rotation:
+            return [
+                e.constraint_error(
+                    "log-rotation",
+                    "'max-bytes' or 'interval'",
+                    "found neither 'max-bytes' nor 'interval' item",
+                )
+            ]
+        if "max-bytes" in rotation:
+            if not isinstance(rotation["max-bytes"], int) or isinstance(
+                rotation["max-bytes"], bool
+            ):
+                errors.append(
+                    e.type_error(
+                        "log-rotation.max-bytes",
+                        "int",
+                        type(rotation["max-bytes"]).__name__,
+                    )
+                )
+            elif rotation["max-bytes"] <= 0:
+                errors.append(
+                    e.value_error(
+                        "log-rotation.max-bytes", rotation["max-bytes"], "must be > 0"
+                    )
+                )
+        if "interval" in rotation and rotation["interval"] not in ROTATION_INTERVALS:
+            errors.append(
+                e.value_error(
+                    "log-rotation.interval",
+                    rotation["interval"],
+                    f"must be one of {', '.join(ROTATION_INTERVALS)}",
+                )
+            )
+        if "compress" in rotation and not isinstance(rotation["compress"], bool):
+            errors.append(
+                e.type_error(
+                    "log-rotation.compress",
+                    "bool",
+                    type(rotation["compress"]).__name__,
+                )
+            )
+        return errors
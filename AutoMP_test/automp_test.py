@@ -4,8 +4,14 @@ import sys
 
 from src.automp_test import AutoMP_test
 from src.log import Log
+from src.logindex import log_command
+from src.tracing import Profiler, Trace
 from src.validator import Validator
 
+if len(sys.argv) > 1 and sys.argv[1] == "log":
+    log_command(sys.argv[2:])
+    sys.exit(0)
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "-c",
@@ -21,8 +27,24 @@ parser.add_argument(
     default=None,
     help="path to the target file",
 )
+parser.add_argument(
+    "--trace",
+    type=str,
+    default=None,
+    help="write a Chrome trace (JSON) of the run to this path",
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    default=None,
+    help="profile the run and write a per-function summary to this path",
+)
 
 args = parser.parse_args()
+if args.trace is not None:
+    Trace.enable(args.trace)
+if args.profile is not None:
+    Profiler.enable(args.profile)
 config_path = args.config
 target_file = args.target
 
@@ -1,12 +1,17 @@
 import json
 import os
 import platform
+import queue
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
+from .compilecache import DEFAULT_CACHE_MAX_BYTES, CompileCache
 from .log import Log
-from .util import normalize_path
+from .pack import Pack
+from .tracing import Trace
+from .util import DEDUP_FILENAME, MANIFEST_FILENAME, normalize_path
 
 
 @dataclass
@@ -14,12 +19,14 @@ class Run:
     exit_code: int = None
     run_time: float = None
     output: str = None
+    cpus: list[int] = None
 
     def to_dict(self):
         return {
             "exit_code": self.exit_code,
             "run_time": self.run_time,
             "output": self.output,
+            "cpus": self.cpus,
         }
 
     @staticmethod
@@ -28,6 +35,7 @@ class Run:
         run.exit_code = data["exit_code"]
         run.run_time = data["run_time"]
         run.output = data["output"]
+        run.cpus = data.get("cpus")
         return run
 
 
@@ -40,10 +48,12 @@ class Task:
     errors: list[str] = None
     flags: list[str] = None
     compilation_time: float = None
+    compilation_cached: bool = None
     executable_path: str = None
     args: list[str] = None
     runs: dict[str, Run] = None
     system: dict = None
+    duplicate_of: str = None
 
     def get_saving_path(self, directory: str):
         return os.path.join(directory, f"{os.path.basename(self.path)}.json")
@@ -60,9 +70,11 @@ class Task:
                     "errors": self.errors,
                     "flags": self.flags,
                     "compilation_time": self.compilation_time,
+                    "compilation_cached": self.compilation_cached,
                     "executable_path": self.executable_path,
                     "args": self.args,
                     "runs": {k: [r.to_dict() for r in v] for k, v in self.runs.items()},
+                    "duplicate_of": self.duplicate_of,
                 },
                 f,
                 indent=4,
@@ -78,10 +90,12 @@ class Task:
         task.errors = data["errors"]
         task.flags = data["flags"]
         task.compilation_time = data["compilation_time"]
+        task.compilation_cached = data.get("compilation_cached")
         task.executable_path = data["executable_path"]
         task.args = data["args"]
         task.runs = {k: [Run.from_dict(r) for r in v] for k, v in data["runs"].items()}
         task.system = data["system"]
+        task.duplicate_of = data.get("duplicate_of")
         return task
 
 
@@ -99,9 +113,23 @@ class AutoMP_test:
             if "input-directory" in data
             else None
         )
+        self._input_pack = (
+            Pack(normalize_path(data["input-pack"], config_file_dir), read_only=True)
+            if "input-pack" in data
+            else None
+        )
         self._output_directory = normalize_path(
             data["output-directory"], config_file_dir
         )
+        rotation = data.get("log-rotation", {})
+        Log.configure_logfile(
+            data.get("log-format", "text"),
+            data.get("log-fsync", "never"),
+            rotation.get("max-bytes", None),
+            rotation.get("interval", None),
+            rotation.get("compress", True),
+        )
+        Log.set_level(data.get("log-level", "info"))
         Log.logfile_write(self._output_directory, "started")
         self._compilation_directory = normalize_path(
             data["compilation-directory"], config_file_dir
@@ -112,6 +140,28 @@ class AutoMP_test:
         self._args: dict = data["args"]
         self._timeout = data.get("timeout", 60)
         self._overwrite_output = data.get("overwrite-output", False)
+        self._reuse_duplicates = data.get("reuse-duplicates", False)
+        self._compile_jobs = data.get("compile-jobs", 1)
+        # disjoint CPU sets of benchmark-cpus CPUs, one per parallel run
+        self._cpu_sets = self.__get_cpu_sets(data.get("benchmark-cpus", None))
+        cache = data.get("compile-cache", None)
+        self._compile_cache = (
+            CompileCache(
+                normalize_path(cache["directory"], config_file_dir),
+                cache.get("max-bytes", DEFAULT_CACHE_MAX_BYTES),
+                self._compiler_command,
+            )
+            if cache is not None
+            else None
+        )
+        # output file -> program ID and program ID -> canonical file of the
+        # input directory or pack, as written by AutoMP_extract --dedup
+        self._dedup_files, self._dedup_programs = self.__load_dedup_index()
+        # (program ID, task name) -> tested task, to reuse for duplicates
+        self._tested: dict[tuple[str, str], Task] = {}
+        # output file -> compiler output of the programs that failed the
+        # syntax pre-check of AutoMP_extract --precheck
+        self._precheck_failures = self.__load_precheck_failures()
 
         target_file = data.get("__target-file", None)
         if target_file is not None:
@@ -123,6 +173,11 @@ class AutoMP_test:
 
         self.__run()
 
+        if self._compile_cache is not None:
+            self._compile_cache.save()
+            message = f"compile cache: {self._compile_cache.hits} hit(s), {self._compile_cache.misses} miss(es)"
+            Log.info(message[0].upper() + message[1:])
+            Log.logfile_write(self._output_directory, message)
         Log.logfile_write(self._output_directory, "ended")
 
     def __get_system_info(self):
@@ -145,16 +200,216 @@ class AutoMP_test:
         }
         return system_info
 
-    def __run(self):
-        for file in ([self.__target_file] if self.__target_file is not None else []) + (
-            [
-                f
-                for f in os.scandir(self._input_directory)
-                if f.is_file() and f.name.endswith(".c")
+    def __get_cpu_sets(self, cpus_per_run: int | None) -> list[list[int]]:
+        if cpus_per_run is None:
+            return []
+        cpus = sorted(os.sched_getaffinity(0))
+        cpu_sets = [
+            cpus[i : i + cpus_per_run]
+            for i in range(0, len(cpus) - cpus_per_run + 1, cpus_per_run)
+        ]
+        Log.info(
+            f"Running {len(cpu_sets)} benchmark(s) at once, each on {cpus_per_run} CPU(s)"
+        )
+        return cpu_sets
+
+    def __load_dedup_index(self):
+        """
+        The dedup index of the input directory, or the one stored in the input
+        pack (AutoMP_extract --pack --dedup copy); the programs of both are
+        named by file name
+        """
+        files, programs = {}, {}
+        if self._input_pack is not None and self._input_pack.exists(DEDUP_FILENAME):
+            data = json.loads(self._input_pack.read(DEDUP_FILENAME))
+            files.update(data["files"])
+            programs.update(data["programs"])
+        if self._input_directory is not None:
+            path = os.path.join(self._input_directory, DEDUP_FILENAME)
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    data = json.load(f)
+                files.update(data["files"])
+                programs.update(data["programs"])
+        return files, programs
+
+    def __load_precheck_failures(self) -> dict[str, str]:
+        """
+        The programs that failed the syntax pre-check of AutoMP_extract, from
+        the manifest in the input directory or the one stored in the input
+        pack (AutoMP_extract --pack)
+        """
+        manifests = []
+        if self._input_pack is not None and self._input_pack.exists(MANIFEST_FILENAME):
+            manifests.append(json.loads(self._input_pack.read(MANIFEST_FILENAME)))
+        if self._input_directory is not None:
+            path = os.path.join(self._input_directory, MANIFEST_FILENAME)
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    manifests.append(json.load(f))
+        return {
+            os.path.basename(entry["output"]): entry.get("precheck_output", "")
+            for data in manifests
+            for entry in data["inputs"].values()
+            if entry.get("precheck") is False and entry["output"] is not None
+        }
+
+    def __get_input_files(self):
+        files = []
+        if self._input_pack is not None:
+            # programs in a pack have the path '<pack>/<name>'
+            files += [
+                MyPosixDirEntry(name, os.path.join(self._input_pack.path, name))
+                for name, _, _ in self._input_pack.entries()
+                if name.endswith(".c")
             ]
-            if self._input_directory is not None
-            else []
+        if self._input_directory is None:
+            return files
+        files += [
+            f
+            for f in os.scandir(self._input_directory)
+            if f.is_file() and f.name.endswith(".c")
+        ]
+        # duplicates that AutoMP_extract only kept as references
+        present = {f.name for f in files}
+        files += [
+            MyPosixDirEntry(name, os.path.join(self._input_directory, name))
+            for name in self._dedup_files
+            if name.endswith(".c") and name not in present
+        ]
+        return files
+
+    def __get_source_path(self, file) -> str:
+        """
+        The file to compile: a program from the input pack is materialized in
+        the compilation directory, a referenced duplicate compiles its
+        canonical file
+        """
+        if (
+            self._input_pack is not None
+            and os.path.dirname(file.path) == self._input_pack.path
         ):
+            path = os.path.join(self._compilation_directory, file.name)
+            with open(path, "wb") as f:
+                f.write(self._input_pack.read(file.name))
+            return path
+        if os.path.exists(file.path):
+            return file.path
+        canonical = self._dedup_programs[self._dedup_files[file.name]]
+        return os.path.join(self._input_directory, canonical)
+
+    def __reuse_duplicate(self, current: Task, file) -> bool:
+        """
+        Records an identical program tested for the same task as duplicate_of
+        instead of testing the program again. The runs stay empty, so that
+        results are not counted twice; they are those of duplicate_of.
+        """
+        program = self._dedup_files.get(file.name)
+        if not self._reuse_duplicates or program is None:
+            return False
+        tested = self._tested.get((program, current.taskname))
+        if tested is None:
+            return False
+
+        current.duplicate_of = tested.path
+        current.save_into_directory(self._output_directory)
+        Log.info(f"  Duplicate of {os.path.basename(tested.path)}, not tested again")
+        Log.logfile_write_test(
+            self._output_directory,
+            current.path,
+            not tested.errors,
+            f"duplicate of {os.path.basename(tested.path)}, see its results",
+        )
+        return True
+
+    def __remember(self, current: Task, file):
+        program = self._dedup_files.get(file.name)
+        if program is not None:
+            self._tested[(program, current.taskname)] = current
+
+    def __compile_ahead(self, files) -> dict[str, tuple]:
+        """
+        Compiles the programs that pass the checks of __run on a pool of
+        compile-jobs threads, before any benchmark runs, and returns the
+        results of __compile by file path. Programs that are skipped or reuse
+        the results of a duplicate are not compiled.
+        """
+        candidates = []
+        seen = set()
+        for file in files:
+            taskname = os.path.basename(file.path).split("__", 2)[1]
+            if not self._overwrite_output and os.path.exists(
+                Task(path=file.path).get_saving_path(self._output_directory)
+            ):
+                continue
+            if not self._args.get(taskname) or file.name in self._precheck_failures:
+                continue
+            program = self._dedup_files.get(file.name)
+            if self._reuse_duplicates and program is not None:
+                if (program, taskname) in seen:
+                    continue
+                seen.add((program, taskname))
+            source_path = self.__get_source_path(file)
+            flags = self.__extract_flags(source_path)
+            if any(flag not in flags for flag in self._necessary_compiler_flags or []):
+                continue
+            candidates.append((file, source_path, flags))
+
+        Log.info(
+            f"Compiling {len(candidates)} program(s) with {self._compile_jobs} jobs"
+        )
+        with ThreadPoolExecutor(self._compile_jobs) as executor:
+            futures = {
+                file.path: executor.submit(
+                    self.__compile, MyPosixDirEntry(file.name, source_path), flags
+                )
+                for file, source_path, flags in candidates
+            }
+        return {path: future.result() for path, future in futures.items()}
+
+    @Trace.traced("AutoMP_test.__run")
+    def __run(self):
+        files = (
+            [self.__target_file] if self.__target_file is not None else []
+        ) + self.__get_input_files()
+        # with compile-jobs, the benchmarks only start once everything is
+        # compiled; pinned benchmarks use every CPU, so the compiler must not
+        # run next to them either
+        compilations = (
+            self.__compile_ahead(files)
+            if self._compile_jobs > 1 or self._cpu_sets
+            else {}
+        )
+        # with benchmark-cpus, the runs of all programs share the CPU sets, and
+        # (task, futures of its runs by argument) are saved once finished
+        executor, free_cpu_sets = None, None
+        pending: list[tuple[Task, dict]] = []
+        if self._cpu_sets:
+            executor = ThreadPoolExecutor(len(self._cpu_sets))
+            free_cpu_sets = queue.Queue()
+            for cpu_set in self._cpu_sets:
+                free_cpu_sets.put(cpu_set)
+        try:
+            self.__run_files(files, compilations, executor, free_cpu_sets, pending)
+            self.__save_finished(pending, wait=True)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    def __run_files(
+        self,
+        files,
+        compilations: dict[str, tuple],
+        executor: ThreadPoolExecutor | None,
+        free_cpu_sets: queue.Queue | None,
+        pending: list[tuple[Task, dict]],
+    ):
+        """
+        Checks, compiles and runs every file; with an executor, the runs are
+        submitted to it and the task is added to pending instead of saved
+        """
+        precheck_failures = 0
+        for file in files:
             Log.info(f"Processing {file.name}")
             current = Task()
             current.system = self.__get_system_info()
@@ -196,8 +451,28 @@ class AutoMP_test:
                 continue
             current.args = self._args[current.taskname]
 
+            # skip programs that already failed the syntax pre-check
+            if file.name in self._precheck_failures:
+                precheck_failures += 1
+                current.errors.append(
+                    f"Syntax error (pre-check): {self._precheck_failures[file.name]}"
+                )
+                current.save_into_directory(self._output_directory)
+                Log.error("  Syntax pre-check failed, skipping")
+                Log.logfile_write_test(
+                    self._output_directory,
+                    current.path,
+                    False,
+                    "syntax pre-check failed",
+                )
+                continue
+
+            if self.__reuse_duplicate(current, file):
+                continue
+            source_path = self.__get_source_path(file)
+
             # check if necessary flags are present
-            current.flags = self.__extract_flags(file.path)
+            current.flags = self.__extract_flags(source_path)
             if self._necessary_compiler_flags is not None:
                 for flag in self._necessary_compiler_flags:
                     if flag not in current.flags:
@@ -218,12 +493,19 @@ class AutoMP_test:
             Log.info("  Passed checks")
 
             # compile and check for compilation errors
-            exit_code, compilation_output, executable_path, duration = self.__compile(
-                file, current.flags
+            if file.path in compilations:
+                compilation = compilations.pop(file.path)
+            else:
+                compilation = self.__compile(
+                    MyPosixDirEntry(file.name, source_path), current.flags
+                )
+            exit_code, compilation_output, executable_path, duration, cached = (
+                compilation
             )
             if exit_code != 0:
                 current.errors.append(f"Compilation error: {compilation_output}")
                 current.save_into_directory(self._output_directory)
+                self.__remember(current, file)
                 Log.error("  Compilation error")
                 Log.logfile_write_test(
                     self._output_directory,
@@ -233,13 +515,31 @@ class AutoMP_test:
                 )
                 continue
             current.compilation_time = duration
+            current.compilation_cached = cached
             current.executable_path = executable_path
-            Log.info("  Compilation successful")
+            Log.info(
+                "  Compilation successful (cached)"
+                if cached
+                else "  Compilation successful"
+            )
 
             # run with args
             current.runs = {}
 
             Log.info(f"  Running program with {len(current.args)} argument(s)")
+            if executor is not None:
+                pending.append(
+                    (
+                        current,
+                        self.__submit_pinned(
+                            executor, free_cpu_sets, executable_path, current.args
+                        ),
+                    )
+                )
+                self.__remember(current, file)
+                self.__save_finished(pending)
+                continue
+
             for i, arg in enumerate(current.args):
                 Log.info(
                     f"    Performing {self._repeat} run(s) with argument(s) '{arg}'"
@@ -255,13 +555,23 @@ class AutoMP_test:
                     run.output = output
                     runs.append(run)
 
-                    Log.debug(f"      {j + 1} / {self._repeat}")
+                    Log.debug("      %d / %d", j + 1, self._repeat)
                 current.runs[arg] = runs
-                Log.debug(f"    {i + 1} / {len(current.args)}")
+                Log.debug("    %d / %d", i + 1, len(current.args))
 
             current.save_into_directory(self._output_directory)
+            self.__remember(current, file)
             Log.logfile_write_test(self._output_directory, current.path, True, "")
 
+        if precheck_failures:
+            Log.error(
+                f"Skipped {precheck_failures} program(s) that failed the syntax pre-check"
+            )
+            Log.logfile_write(
+                self._output_directory,
+                f"skipped {precheck_failures} program(s) that failed the syntax pre-check",
+            )
+
     def __extract_flags(self, path):
         with open(path, "r") as f:
             lines = f.readlines()
@@ -282,10 +592,23 @@ class AutoMP_test:
         )
         return flags_string.split(" ")
 
+    @Trace.traced("AutoMP_test.__compile")
     def __compile(self, file: os.DirEntry, flags: list[str]):
+        """
+        Returns the exit code, output, executable path and time of the
+        compilation, and whether the executable came from the compile cache
+        (with the time of its original compilation)
+        """
         executable_path = os.path.join(
             self._compilation_directory, file.name.removesuffix(".c")
         )
+        if self._compile_cache is not None:
+            key = self._compile_cache.key(
+                file.path, flags, self._necessary_compiler_flags or []
+            )
+            compilation_time = self._compile_cache.get(key, executable_path)
+            if compilation_time is not None:
+                return 0, "", executable_path, compilation_time, True
         start_time = time.time()
         process = subprocess.run(
             [self._compiler_command, file.path, "-o", executable_path, *flags],
@@ -295,16 +618,83 @@ class AutoMP_test:
         end_time = time.time()
         exit_code = process.returncode
         compilation_output = process.stdout + process.stderr
+        if self._compile_cache is not None and exit_code == 0:
+            self._compile_cache.put(key, executable_path, end_time - start_time)
+
+        return (
+            exit_code,
+            compilation_output,
+            executable_path,
+            end_time - start_time,
+            False,
+        )
 
-        return exit_code, compilation_output, executable_path, end_time - start_time
+    def __submit_pinned(
+        self,
+        executor: ThreadPoolExecutor,
+        free_cpu_sets: queue.Queue,
+        executable_path: str,
+        args: list[str],
+    ) -> dict:
+        """
+        Submits all runs of a program, each to be pinned to a CPU set that no
+        other run (of this or another program) uses at the same time, and
+        returns their futures by argument
+        """
+
+        def run_on_free_cpus(arg: str) -> Run:
+            cpus = free_cpu_sets.get()
+            try:
+                # the program inherits the affinity of the thread that starts it
+                os.sched_setaffinity(0, cpus)
+                exit_code, output, duration = self.__run_executable(
+                    executable_path, arg, cpus
+                )
+            finally:
+                free_cpu_sets.put(cpus)
+            return Run(exit_code, duration, output, cpus)
+
+        futures = {}
+        for arg in args:
+            Log.info(f"    Performing {self._repeat} run(s) with argument(s) '{arg}'")
+            futures[arg] = [
+                executor.submit(run_on_free_cpus, arg) for _ in range(self._repeat)
+            ]
+        return futures
 
-    def __run_executable(self, executable_path: str, arg: str):
+    def __save_finished(self, pending: list[tuple[Task, dict]], wait: bool = False):
+        """Saves the tasks whose pinned runs are all finished (with wait: all)"""
+        for current, futures in list(pending):
+            if not wait and not all(f.done() for fs in futures.values() for f in fs):
+                continue
+            current.runs = {
+                arg: [f.result() for f in fs] for arg, fs in futures.items()
+            }
+            current.save_into_directory(self._output_directory)
+            Log.logfile_write_test(self._output_directory, current.path, True, "")
+            pending.remove((current, futures))
+
+    @Trace.traced("AutoMP_test.__run_executable")
+    def __run_executable(self, executable_path: str, arg: str, cpus: list[int] = None):
+        """
+        With cpus, the OpenMP threads of the program are placed on these CPUs;
+        the calling thread must already be pinned to them (__submit_pinned)
+        """
+        env = None
+        if cpus is not None:
+            env = {
+                **os.environ,
+                "OMP_NUM_THREADS": str(len(cpus)),
+                "OMP_PLACES": ",".join(f"{{{cpu}}}" for cpu in cpus),
+                "OMP_PROC_BIND": "close",
+            }
         try:
             process = subprocess.run(
                 [executable_path, *arg.split(" ")],
                 capture_output=True,
                 text=True,
                 timeout=self._timeout,
+                env=env,
             )
             exit_code = process.returncode
             output = process.stdout + process.stderr
@@ -313,8 +703,34 @@ class AutoMP_test:
             output = "timeout"
 
         if exit_code == 0:
-            _, run_time = json.loads(output)
+            run_time = parse_run_time(process.stdout)
+            if run_time is None:
+                Log.error(r"      Output has no \[result, run_time] line")
         else:
             run_time = 0
 
         return exit_code, output, run_time
+
+
+def parse_run_time(stdout: str) -> float | None:
+    """
+    Returns the run time of the last '[result, run_time]' line of the output,
+    so that other output of the program does not break the protocol, or None
+    if there is no such line
+    """
+    for line in reversed(stdout.splitlines()):
+        line = line.strip()
+        if not line.startswith("["):
+            continue
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if (
+            isinstance(value, list)
+            and len(value) == 2
+            and isinstance(value[1], (int, float))
+            and not isinstance(value[1], bool)
+        ):
+            return value[1]
+    return None
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+CACHE_INDEX_FILENAME = "index.json"
+# the names of cached executables and of their temporary files
+CACHE_FILE_PATTERN = re.compile(r"[0-9a-f]{64}(\.tmp\w*)?")
+DEFAULT_CACHE_MAX_BYTES = 1024**3
+HASH_CHUNK_BYTES = 64 * 1024
+
+
+class CompileCache:
+    """
+    CompileCache keeps compiled executables in a directory, addressed by the
+    hash of everything the compilation depends on: the source, the extracted
+    flags, the necessary compiler flags and the compiler version. The index
+    ('index.json') records the size, original compilation time and last use
+    of every executable; once the cache exceeds max_bytes, the least recently
+    used executables are evicted. It can be used from several threads.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, compiler_command: str):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._index_path = os.path.join(directory, CACHE_INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._compiler_version = CompileCache.__compiler_version(compiler_command)
+        self._entries: dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r") as f:
+                self._entries = json.load(f)
+        # executables without an entry (or entries without an executable) are
+        # left over from a run that did not save the index; other files are
+        # not the cache's and are left alone
+        for entry in os.scandir(directory):
+            if (
+                entry.is_file(follow_symlinks=False)
+                and CACHE_FILE_PATTERN.fullmatch(entry.name)
+                and entry.name not in self._entries
+            ):
+                os.remove(entry.path)
+        self._entries = {
+            key: entry
+            for key, entry in self._entries.items()
+            if os.path.exists(os.path.join(directory, key))
+        }
+
+    @staticmethod
+    def __compiler_version(compiler_command: str) -> str:
+        try:
+            process = subprocess.run(
+                [compiler_command, "--version"], capture_output=True, text=True
+            )
+        except OSError:
+            return ""
+        return process.stdout + process.stderr
+
+    def key(self, source_path: str, flags: list[str], necessary_flags: list[str]):
+        source_digest = hashlib.sha256()
+        with open(source_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                source_digest.update(chunk)
+        digest = hashlib.sha256(source_digest.digest())
+        digest.update(
+            json.dumps([flags, necessary_flags, self._compiler_version]).encode()
+        )
+        return digest.hexdigest()
+
+    def get(self, key: str, executable_path: str) -> float | None:
+        """
+        Copies the cached executable to executable_path and returns its
+        original compilation time, or None on a miss
+        """
+        # under the lock, so that the executable is not evicted while copied
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = time.time()
+            shutil.copy2(os.path.join(self._directory, key), executable_path)
+            return entry["compilation_time"]
+
+    def put(self, key: str, executable_path: str, compilation_time: float):
+        path = os.path.join(self._directory, key)
+        # a temporary file per thread, the same program may be put twice
+        fd, temporary_path = tempfile.mkstemp(prefix=f"{key}.tmp", dir=self._directory)
+        os.close(fd)
+        shutil.copy2(executable_path, temporary_path)
+        with self._lock:
+            os.replace(temporary_path, path)
+            self._entries[key] = {
+                "size": os.path.getsize(path),
+                "compilation_time": compilation_time,
+                "last_used": time.time(),
+            }
+            self.__evict()
+
+    def __evict(self):
+        total = sum(entry["size"] for entry in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["last_used"]):
+            if total <= self._max_bytes:
+                break
+            total -= self._entries.pop(key)["size"]
+            os.remove(os.path.join(self._directory, key))
+
+    def save(self):
+        with self._lock:
+            with open(f"{self._index_path}.tmp", "w") as f:
+                json.dump(self._entries, f)
+            os.replace(f"{self._index_path}.tmp", self._index_path)
@@ -1,11 +1,221 @@
+import atexit
+import gzip
+import json
 import os
-from time import strftime
+import queue
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from time import localtime, strftime
 
 from rich import print
 
+from .logindex import LogIndex
+
+LEVELS = {"debug": 10, "info": 20, "error": 40}
+FSYNC_POLICIES = ["never", "batch", "always"]
+LOG_FORMATS = ["text", "jsonl"]
+LOG_FLUSH_INTERVAL_SECONDS = 0.5
+LOG_BATCH_SIZE = 1000
+# rotation interval -> strftime format of the period a log file belongs to
+ROTATION_INTERVALS = {"hourly": "%Y%m%d%H", "daily": "%Y%m%d", "weekly": "%G%V"}
+
+
+class LogWriter:
+    """
+    LogWriter appends records to log files from a single background thread.
+    Every file is opened once and kept open, records are written in the order
+    in which they were submitted and flushed in batches; the fsync policy
+    decides whether a batch ('batch') or every record ('always') is synced to
+    disk. If the background thread fails, the error is reported on stderr and
+    records are written synchronously from then on.
+
+    A file is rotated to '<name>.<timestamp>' (gzip-compressed to '.gz' if
+    compress is set) once it exceeds max_bytes or a new rotation interval
+    begins. Every record is added to the sidecar index of its file.
+    """
+
+    def __init__(
+        self,
+        log_format: str = "text",
+        fsync: str = "never",
+        max_bytes: int | None = None,
+        interval: str | None = None,
+        compress: bool = True,
+    ):
+        self._format = log_format
+        self._fsync = fsync
+        self._max_bytes = max_bytes
+        self._interval = interval
+        self._compress = compress
+        self._queue = queue.SimpleQueue()
+        self._files = {}
+        self._indexes = {}
+        self._periods = {}
+        # set once the background thread failed, records are then written by
+        # the threads that submit them
+        self._synchronous = False
+        # reentrant, signal handlers of the main thread log while it may hold it
+        self._lock = threading.RLock()
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._thread.start()
+
+    def write(self, path: str, text: str, fields: dict):
+        with self._lock:
+            if self._synchronous:
+                self.__write_synchronously([(path, text, fields)])
+            else:
+                self._queue.put((path, text, fields))
+
+    def close(self):
+        with self._lock:
+            if self._synchronous:
+                self.__close_files()
+            else:
+                self._queue.put(None)
+        self._thread.join()
+
+    def __run(self):
+        running = True
+        while running:
+            try:
+                batch = deque([self._queue.get(timeout=LOG_FLUSH_INTERVAL_SECONDS)])
+            except queue.Empty:
+                continue
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                running = self.__write_batch(batch)
+            except Exception as error:
+                self.__fall_back(error, batch)
+                return
+        self.__close_files()
+
+    def __write_batch(self, batch: deque) -> bool:
+        """
+        Writes the records of the batch, removing each one once it is written,
+        and returns False if the batch ends with the closing marker
+        """
+        touched = set()
+        running = True
+        while batch:
+            if batch[0] is None:
+                batch.popleft()
+                running = False
+                break
+            path, text, fields = batch[0]
+            if self._format == "jsonl":
+                line = (json.dumps(fields) + "\n").encode()
+            else:
+                line = (text + "\n").encode()
+            file = self.__get_file(path, len(line))
+            self._indexes[path].add(file.tell(), len(line), fields)
+            file.write(line)
+            if self._fsync == "always":
+                file.flush()
+                os.fsync(file.fileno())
+            touched.add(path)
+            batch.popleft()
+
+        for path in touched:
+            self._files[path].flush()
+            if self._fsync == "batch":
+                os.fsync(self._files[path].fileno())
+            self._indexes[path].commit()
+        return running
+
+    def __fall_back(self, error: Exception, batch: deque):
+        """
+        Reports an error of the background thread and switches to writing in
+        the calling threads, starting with the records it did not write
+        """
+        sys.stderr.write(
+            f"Log writer failed ({error!r}), writing log records synchronously\n"
+        )
+        with self._lock:
+            self._synchronous = True
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.__write_synchronously(batch)
+
+    def __write_synchronously(self, records):
+        for record in records:
+            if record is None:
+                self.__close_files()
+                continue
+            try:
+                self.__write_batch(deque([record]))
+            except Exception as error:
+                sys.stderr.write(f"Log record lost ({error!r}): {record[1]}\n")
+
+    def __close_files(self):
+        for path in self._files:
+            self._files[path].close()
+            self._indexes[path].close()
+        self._files = {}
+        self._indexes = {}
+
+    def __get_file(self, path: str, length: int):
+        file = self._files.get(path)
+        if file is None:
+            file = open(path, "ab")
+            self._files[path] = file
+            self._indexes[path] = LogIndex(path)
+            self._indexes[path].catch_up()
+            # the period of an existing file is the one it was last written in
+            self._periods[path] = self.__period(
+                os.path.getmtime(path) if file.tell() > 0 else time.time()
+            )
+        if file.tell() > 0 and (
+            (self._max_bytes is not None and file.tell() + length > self._max_bytes)
+            or self.__period(time.time()) != self._periods[path]
+        ):
+            file = self.__rotate(path)
+        return file
+
+    def __period(self, seconds: float) -> str | None:
+        if self._interval is None:
+            return None
+        return strftime(ROTATION_INTERVALS[self._interval], localtime(seconds))
+
+    def __rotate(self, path: str):
+        self._files[path].close()
+        rotated = f"{path}.{strftime('%Y%m%d%H%M%S')}"
+        suffix = 0
+        while os.path.exists(rotated) or os.path.exists(f"{rotated}.gz"):
+            suffix += 1
+            rotated = f"{path}.{strftime('%Y%m%d%H%M%S')}-{suffix}"
+        os.replace(path, rotated)
+        if self._compress:
+            with (
+                open(rotated, "rb") as source,
+                gzip.open(f"{rotated}.gz", "wb") as target,
+            ):
+                shutil.copyfileobj(source, target)
+            os.remove(rotated)
+            rotated += ".gz"
+        self._indexes[path].rename(os.path.basename(path), os.path.basename(rotated))
+
+        file = open(path, "ab")
+        self._files[path] = file
+        self._periods[path] = self.__period(time.time())
+        return file
+
 
 class Log:
     debug_mode = False
+    level = LEVELS["info"]
+    _writer: LogWriter | None = None
+    _prefix_second = None
+    _prefix = None
 
     @staticmethod
     def _color(message: str, color: str):
@@ -22,44 +232,99 @@ class Log:
     @staticmethod
     def set_debug_mode(boolean: bool):
         Log.debug_mode = boolean
+        if boolean:
+            Log.level = LEVELS["debug"]
+
+    @staticmethod
+    def set_level(level: str):
+        Log.level = LEVELS[level]
+        Log.debug_mode = Log.level <= LEVELS["debug"]
+
+    @staticmethod
+    def configure_logfile(
+        log_format: str = "text",
+        fsync: str = "never",
+        max_bytes: int | None = None,
+        interval: str | None = None,
+        compress: bool = True,
+    ):
+        if Log._writer is not None:
+            Log._writer.close()
+        Log._writer = LogWriter(log_format, fsync, max_bytes, interval, compress)
+
+    @staticmethod
+    def close():
+        if Log._writer is not None:
+            Log._writer.close()
+            Log._writer = None
+
+    @staticmethod
+    def _get_prefix():
+        # the prefix only changes once per second
+        now = strftime("%Y-%m-%d %H:%M:%S")
+        if now != Log._prefix_second:
+            Log._prefix = f"{Log._color('AutoMP_test', 'purple')} @ {Log._color(Log._bold(now), 'cyan')} |"
+            Log._prefix_second = now
+        return Log._prefix
+
+    @staticmethod
+    def _write(log_directory: str, level: str, text: str, fields: dict):
+        if LEVELS[level] < Log.level:
+            return
+        if Log._writer is None:
+            Log._writer = LogWriter()
+        fields["level"] = level
+        Log._writer.write(os.path.join(log_directory, "log.txt"), text, fields)
 
     @staticmethod
     def info(message: str):
-        print(
-            f"{Log._color('AutoMP_test', 'purple')} @ {Log._color(Log._bold(strftime('%Y-%m-%d %H:%M:%S')), 'cyan')} | {Log._color(message, 'white')}"
-        )
+        if Log.level <= LEVELS["info"]:
+            print(f"{Log._get_prefix()} {Log._color(message, 'white')}")
 
     @staticmethod
     def error(message: str):
-        print(
-            f"{Log._color('AutoMP_test', 'purple')} @ {Log._color(Log._bold(strftime('%Y-%m-%d %H:%M:%S')), 'cyan')} | {Log._color(message, 'red')}"
-        )
+        print(f"{Log._get_prefix()} {Log._color(message, 'red')}")
 
     @staticmethod
     def success(message: str):
-        print(
-            f"{Log._color('AutoMP_test', 'purple')} @ {Log._color(Log._bold(strftime('%Y-%m-%d %H:%M:%S')), 'cyan')} | {Log._color(message, 'green')}"
-        )
+        if Log.level <= LEVELS["info"]:
+            print(f"{Log._get_prefix()} {Log._color(message, 'green')}")
 
     @staticmethod
-    def debug(message: str):
+    def debug(message: str, *args):
+        """The message is only formatted (with %-style args) if debug output is on"""
         if Log.debug_mode:
-            print(
-                f"{Log._color('AutoMP_test', 'purple')} @ {Log._color(Log._bold(strftime('%Y-%m-%d %H:%M:%S')), 'cyan')} | {Log._color(message, 'grey30')}"
-            )
+            if args:
+                message = message % args
+            print(f"{Log._get_prefix()} {Log._color(message, 'grey30')}")
 
     @staticmethod
     def logfile_write(log_directory: str, message: str):
         timestamp_str = strftime("%Y%m%d%H%M%S")
-        with open(os.path.join(log_directory, "log.txt"), "a") as f:
-            f.write(f"{timestamp_str};{message}\n")
+        Log._write(
+            log_directory,
+            "info",
+            f"{timestamp_str};{message}",
+            {"timestamp": timestamp_str, "message": message},
+        )
 
     @staticmethod
     def logfile_write_test(
         log_directory: str, filename: str, status: bool, message: str
     ):
         timestamp_str = strftime("%Y%m%d%H%M%S")
-        with open(os.path.join(log_directory, "log.txt"), "a") as f:
-            f.write(
-                f"{timestamp_str};{'SUCCESS' if status else 'FAILURE'};{filename};{message}\n"
-            )
+        status_str = "SUCCESS" if status else "FAILURE"
+        Log._write(
+            log_directory,
+            "info" if status else "error",
+            f"{timestamp_str};{status_str};{filename};{message}",
+            {
+                "timestamp": timestamp_str,
+                "status": status_str,
+                "file": filename,
+                "message": message,
+            },
+        )
+
+
+atexit.register(Log.close)
@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import time
+import urllib.parse
+
+SQLITE_HEADER = b"SQLite format 3\0"
+PACK_BATCH_SIZE = 1000
+
+
+def is_pack(path: str) -> bool:
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as file:
+        return file.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+class Pack:
+    """
+    Pack stores many small files in one SQLite database (table 'files' with
+    name, modification time and content), with random access by name, to
+    avoid one inode and directory entry per response or program. The
+    connection is opened lazily, so a Pack can be passed to worker processes.
+    A read-only pack (an input) is neither created nor switched to WAL mode,
+    so that it can be read from read-only media and by several processes.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = os.path.abspath(path)
+        self.read_only = read_only
+        self._connection = None
+
+    def __getstate__(self):
+        return {"path": self.path, "read_only": self.read_only, "_connection": None}
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None and self.read_only:
+            self._connection = sqlite3.connect(
+                f"file:{urllib.parse.quote(self.path)}?mode=ro", uri=True, timeout=60
+            )
+        elif self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.executescript(
+                """
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS files (
+                    name TEXT PRIMARY KEY, mtime_ns INTEGER, content BLOB
+                );
+                """
+            )
+        return self._connection
+
+    def entries(self) -> list[tuple[str, int, int]]:
+        """Returns (name, size, mtime_ns) of every file"""
+        return self.connection.execute(
+            "SELECT name, length(content), mtime_ns FROM files ORDER BY name"
+        ).fetchall()
+
+    def exists(self, name: str) -> bool:
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM files WHERE name = ?", (name,)
+            ).fetchone()
+            is not None
+        )
+
+    def read(self, name: str) -> bytes:
+        row = self.connection.execute(
+            "SELECT content FROM files WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"'{name}' not in pack '{self.path}'")
+        return row[0]
+
+    def mtime_ns(self, name: str) -> int:
+        row = self.connection.execute(
+            "SELECT mtime_ns FROM files WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"'{name}' not in pack '{self.path}'")
+        return row[0]
+
+    def write(self, name: str, content: bytes, mtime_ns: int | None = None):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (name, mtime_ns or time.time_ns(), content),
+            )
+
+    def remove(self, name: str):
+        with self.connection:
+            self.connection.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def add_directory(self, directory: str) -> int:
+        """Adds every file of the directory in batches and returns their number"""
+        count = 0
+        batch = []
+        for entry in os.scandir(directory):
+            if not entry.is_file():
+                continue
+            with open(entry.path, "rb") as file:
+                batch.append((entry.name, entry.stat().st_mtime_ns, file.read()))
+            if len(batch) >= PACK_BATCH_SIZE:
+                count += self.__insert(batch)
+                batch = []
+        return count + self.__insert(batch)
+
+    def __insert(self, batch: list[tuple]) -> int:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)", batch
+            )
+        return len(batch)
+
+    def close(self):
+        if not self.read_only:
+            # without WAL, readers need no '-shm' file next to the pack; this
+            # also applies what worker processes wrote to the '-wal' file
+            try:
+                self.connection.execute("PRAGMA journal_mode = DELETE")
+            except sqlite3.OperationalError:
+                pass  # still open elsewhere
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -1,6 +1,11 @@
 import os
 import pathlib
 
+# files that AutoMP_extract keeps next to the programs
+DEDUP_FILENAME = "dedup.json"
+MANIFEST_FILENAME = "manifest.json"
+IGNORED_INPUT_FILES = [MANIFEST_FILENAME, DEDUP_FILENAME]
+
 
 def normalize_path(path: str, directory: str) -> str:
     if os.path.isabs(path):
@@ -6,8 +6,9 @@ from typing import Union
 import src.error as e
 from ruamel.yaml import YAML
 
-from .log import Log
-from .util import normalize_path
+from .log import FSYNC_POLICIES, LEVELS, LOG_FORMATS, ROTATION_INTERVALS, Log
+from .pack import is_pack
+from .util import IGNORED_INPUT_FILES, normalize_path
 
 
 def _validate(
@@ -58,7 +59,13 @@ class Validator:
         errors.extend(Validator.__validate_args(data))
         errors.extend(Validator.__validate_repeat(data))
         errors.extend(Validator.__validate_overwrite_output(data))
+        errors.extend(Validator.__validate_reuse_duplicates(data))
         errors.extend(Validator.__validate_timeout(data))
+        errors.extend(Validator.__validate_compile_jobs(data))
+        errors.extend(Validator.__validate_compile_cache(data))
+        errors.extend(Validator.__validate_benchmark_cpus(data))
+        errors.extend(Validator.__validate_log_options(data))
+        errors.extend(Validator.__validate_log_rotation(data))
 
         return errors, data
 
@@ -87,17 +94,25 @@ class Validator:
     def __validate_input(data, target_file):
         errors = []
         errors.extend(Validator.__validate_input_directory(data))
+        errors.extend(Validator.__validate_input_pack(data))
         errors.extend(Validator.__validate_target_file(target_file))
 
         if errors:
             return errors
-        elif "input-directory" not in data and target_file is None:
+        elif (
+            "input-directory" not in data
+            and "input-pack" not in data
+            and target_file is None
+        ):
             return [e.missing_item("input-directory")]
 
         if target_file is None:
-            path = normalize_path(data["input-directory"], Validator.__path)
-            if not os.listdir(path):
-                return [e.value_error("input-directory", path, "directory is empty")]
+            if "input-directory" in data:
+                path = normalize_path(data["input-directory"], Validator.__path)
+                if not os.listdir(path):
+                    return [
+                        e.value_error("input-directory", path, "directory is empty")
+                    ]
         else:
             data["__target-file"] = target_file
 
@@ -123,6 +138,19 @@ class Validator:
 
         return []
 
+    @staticmethod
+    def __validate_input_pack(data) -> list[str]:
+        errors = _validate(data, "input-pack", False, str)
+        if errors or "input-pack" not in data:
+            return errors
+
+        path = normalize_path(data["input-pack"], Validator.__path)
+        if not os.path.exists(path):
+            return [e.value_error("input-pack", path, "path does not exist")]
+        if not is_pack(path):
+            return [e.value_error("input-pack", path, "file is not a pack")]
+        return []
+
     @staticmethod
     def __validate_input_directory(data) -> list[str]:
         errors = _validate(data, "input-directory", False, str)
@@ -150,7 +178,9 @@ class Validator:
         invalid_files = [
             f.name
             for f in os.scandir(path)
-            if len(f.name.split("__")) != 3 and f.name != "log.txt"
+            if len(f.name.split("__")) != 3
+            and not f.name.startswith("log.txt")
+            and f.name not in IGNORED_INPUT_FILES
         ]
         if invalid_files:
             return [
@@ -268,6 +298,10 @@ class Validator:
 
         return []
 
+    @staticmethod
+    def __validate_reuse_duplicates(data) -> list[str]:
+        return _validate(data, "reuse-duplicates", False, bool)
+
     @staticmethod
     def __validate_timeout(data) -> list[str]:
         errors = _validate(data, "timeout", False, int)
@@ -280,3 +314,161 @@ class Validator:
             ]
 
         return []
+
+    @staticmethod
+    def __validate_compile_jobs(data) -> list[str]:
+        errors = _validate(data, "compile-jobs", False, int)
+        if errors:
+            return errors
+
+        if "compile-jobs" in data and int(data["compile-jobs"]) < 1:
+            return [
+                e.value_error(
+                    "compile-jobs", data["compile-jobs"], "value has to be above 0"
+                )
+            ]
+
+        return []
+
+    @staticmethod
+    def __validate_compile_cache(data) -> list[str]:
+        errors = _validate(data, "compile-cache", False, dict)
+        if errors or "compile-cache" not in data:
+            return errors
+
+        cache = data["compile-cache"]
+        if "directory" not in cache:
+            return [e.missing_item("compile-cache.directory")]
+        if not isinstance(cache["directory"], str):
+            errors.append(
+                e.type_error(
+                    "compile-cache.directory", "str", type(cache["directory"]).__name__
+                )
+            )
+        else:
+            directory = normalize_path(cache["directory"], Validator.__path)
+            if os.path.exists(directory) and not os.path.isdir(directory):
+                errors.append(
+                    e.value_error(
+                        "compile-cache.directory",
+                        cache["directory"],
+                        "path is not a directory",
+                    )
+                )
+            # the cache removes files it does not know from its directory
+            for key in ["input-directory", "output-directory", "compilation-directory"]:
+                if isinstance(data.get(key), str) and os.path.realpath(
+                    directory
+                ) == os.path.realpath(normalize_path(data[key], Validator.__path)):
+                    errors.append(
+                        e.value_error(
+                            "compile-cache.directory",
+                            cache["directory"],
+                            f"must not be the {key}",
+                        )
+                    )
+        if "max-bytes" in cache:
+            if not isinstance(cache["max-bytes"], int) or isinstance(
+                cache["max-bytes"], bool
+            ):
+                errors.append(
+                    e.type_error(
+                        "compile-cache.max-bytes",
+                        "int",
+                        type(cache["max-bytes"]).__name__,
+                    )
+                )
+            elif cache["max-bytes"] <= 0:
+                errors.append(
+                    e.value_error(
+                        "compile-cache.max-bytes", cache["max-bytes"], "must be > 0"
+                    )
+                )
+        return errors
+
+    @staticmethod
+    def __validate_benchmark_cpus(data) -> list[str]:
+        errors = _validate(data, "benchmark-cpus", False, int)
+        if errors or "benchmark-cpus" not in data:
+            return errors
+
+        available = len(os.sched_getaffinity(0))
+        if not 1 <= data["benchmark-cpus"] <= available:
+            return [
+                e.value_error(
+                    "benchmark-cpus",
+                    data["benchmark-cpus"],
+                    f"value has to be between 1 and the {available} available CPU(s)",
+                )
+            ]
+
+        return []
+
+    @staticmethod
+    def __validate_log_options(data) -> list[str]:
+        errors = []
+        for key, allowed in [
+            ("log-format", LOG_FORMATS),
+            ("log-fsync", FSYNC_POLICIES),
+            ("log-level", list(LEVELS.keys())),
+        ]:
+            key_errors = _validate(data, key, False, str)
+            if key_errors:
+                errors.extend(key_errors)
+            elif key in data and data[key] not in allowed:
+                errors.append(
+                    e.value_error(
+                        key, data[key], f"must be one of {', '.join(allowed)}"
+                    )
+                )
+        return errors
+
+    @staticmethod
+    def __validate_log_rotation(data) -> list[str]:
+        errors = _validate(data, "log-rotation", False, dict)
+        if errors or "log-rotation" not in data:
+            return errors
+
+        rotation = data["log-rotation"]
+        if "max-bytes" not in rotation and "interval" not in rotation:
+            return [
+                e.constraint_error(
+                    "log-rotation",
+                    "'max-bytes' or 'interval'",
+                    "found neither 'max-bytes' nor 'interval' item",
+                )
+            ]
+        if "max-bytes" in rotation:
+            if not isinstance(rotation["max-bytes"], int) or isinstance(
+                rotation["max-bytes"], bool
+            ):
+                errors.append(
+                    e.type_error(
+                        "log-rotation.max-bytes",
+                        "int",
+                        type(rotation["max-bytes"]).__name__,
+                    )
+                )
+            elif rotation["max-bytes"] <= 0:
+                errors.append(
+                    e.value_error(
+                        "log-rotation.max-bytes", rotation["max-bytes"], "must be > 0"
+                    )
+                )
+        if "interval" in rotation and rotation["interval"] not in ROTATION_INTERVALS:
+            errors.append(
+                e.value_error(
+                    "log-rotation.interval",
+                    rotation["interval"],
+                    f"must be one of {', '.join(ROTATION_INTERVALS)}",
+                )
+            )
+        if "compress" in rotation and not isinstance(rotation["compress"], bool):
+            errors.append(
+                e.type_error(
+                    "log-rotation.compress",
+                    "bool",
+                    type(rotation["compress"]).__name__,
+                )
+            )
+        return errors